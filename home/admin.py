@@ -0,0 +1,18 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.contrib import admin
+
+from home.models import ImageJob
+
+
+@admin.register(ImageJob)
+class ImageJobAdmin(admin.ModelAdmin):
+    list_display = ('image', 'status', 'attempts', 'run_after', 'created_at', 'updated_at')
+    list_filter = ('status',)
+    raw_id_fields = ('image',)
+    actions = ['retry']
+
+    def retry(self, request, queryset):
+        for job in queryset:
+            job.retry()
+    retry.short_description = u'重新处理'
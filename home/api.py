@@ -0,0 +1,316 @@
+# -*- coding: UTF-8 -*-
+"""
+Read-only JSON API over the live, public pages of the site.
+
+``api/pages/`` lists them from newest to oldest, in windows of ``limit``
+pages; ``next_cursor`` goes in the ``after`` parameter of the next request.
+``type`` (like ``home.GalleryPage``) and ``child_of`` (a page id) filter
+them. ``api/pages/<id>/`` returns one page.
+
+The fields are the ``api_fields`` of the page models and ``BASE_FIELDS``.
+``fields`` picks them, comma separated, or all of them with ``*``; listings
+default to ``LISTING_FIELDS`` and pages to all their fields. The images come
+with the renditions the site templates use, the gallery images and the
+images of all the pages in a response are loaded together, so the number of
+queries doesn't grow with the number of pages. Rich text fields are given
+as they are stored, like the Wagtail API does.
+
+Responses are cached and carry an ETag made of the page cache versions, see
+home.page_cache: publishing, unpublishing, moving or deleting a page
+invalidates the listings and the page.
+"""
+from __future__ import absolute_import, unicode_literals
+import hashlib
+import json
+from collections import defaultdict
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import ForeignKey
+from django.http import Http404, HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response
+from django.views.decorators.http import require_safe
+
+from wagtail.wagtailcore.fields import StreamField
+from wagtail.wagtailcore.models import Page, PageViewRestriction
+from wagtail.wagtailimages.models import Image as WagtailImage
+
+from home.images import get_responsive_renditions, prefetch_renditions, responsive_filter_specs
+from home.models import CategoryPage, GalleryPage, HomePage, SimplePage
+from home.page_cache import get_etag, get_last_modified, get_listing_versions, get_timeout, get_versions, set_validators
+from home.pagination import keyset_paginate
+
+RESPONSE_KEY = 'home:api:%s'
+
+PAGE_MODELS = [HomePage, CategoryPage, SimplePage, GalleryPage]
+BASE_FIELDS = ['id', 'type', 'title', 'slug', 'url', 'first_published_at', 'last_published_at']
+LISTING_FIELDS = ['id', 'type', 'title', 'url', 'first_published_at']
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# The renditions given for the images of each field, the width ladders the
+# site templates show them with
+IMAGE_FILTERS = {
+    'thumbnail': CategoryPage.sub_page_thumbnail_filter,
+    'cover': CategoryPage.sub_page_thumbnail_filter,
+    'image': GalleryPage.carousel_filter,
+}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def get_type_name(model):
+    return '%s.%s' % (model._meta.app_label, model.__name__)
+
+
+def get_fields(model):
+    return BASE_FIELDS + [name for name in model.api_fields if name not in BASE_FIELDS]
+
+
+def parse_fields(value, models, default):
+    """
+    Return the field names asked for by the ``fields`` parameter ``value``,
+    any of the fields of ``models``, ``default`` when it's empty.
+    """
+    if not value:
+        return default
+    allowed = []
+    for model in models:
+        allowed.extend(name for name in get_fields(model) if name not in allowed)
+    if value == '*':
+        return allowed
+    names = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in names if name not in allowed]
+    if unknown:
+        raise BadRequest('Unknown fields: %s' % ', '.join(unknown))
+    return ['id', 'type'] + [name for name in names if name not in ('id', 'type')]
+
+
+def parse_models(value):
+    if not value:
+        return PAGE_MODELS
+    for model in PAGE_MODELS:
+        if get_type_name(model).lower() == value.lower():
+            return [model]
+    raise BadRequest('Unknown type: %s' % value)
+
+
+def parse_int(value, name, default=None):
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise BadRequest('%s must be an integer' % name)
+
+
+def get_pages(request, models):
+    """
+    Return the live pages of ``models`` on the site of ``request``, leaving
+    out the private ones.
+    """
+    content_types = ContentType.objects.get_for_models(*models).values()
+    pages = Page.objects.live().filter(content_type__in=content_types)
+    site = getattr(request, 'site', None)
+    if site is not None:
+        pages = pages.descendant_of(site.root_page, inclusive=True)
+    # Like PageQuerySet.public, without a query per restriction
+    restricted_paths = PageViewRestriction.objects.values_list('page__path', flat=True)
+    for path in restricted_paths:
+        pages = pages.exclude(path__startswith=path)
+    return pages
+
+
+def get_child_relations(model, fields):
+    return [
+        model._meta.get_field(name) for name in fields
+        if name in model.api_fields and model._meta.get_field(name).one_to_many
+    ]
+
+
+def is_image_field(field):
+    return isinstance(field, ForeignKey) and field.related_model is WagtailImage
+
+
+def get_image_fields(model, fields):
+    return [
+        model._meta.get_field(name) for name in fields
+        if name in model.api_fields and is_image_field(model._meta.get_field(name))
+    ]
+
+
+def load_related(pages, fields):
+    """
+    Resolve what the ``fields`` of ``pages`` refer to, with a query per
+    child relation, one for the images and one per rendition ladder. Return
+    ``{(page id, relation name): children}`` and ``{image id: image}``.
+    """
+    children = defaultdict(list)
+    images_by_id = {}
+    image_ids = set()
+    images_by_filter = defaultdict(list)
+
+    pages_by_model = defaultdict(list)
+    for page in pages:
+        pages_by_model[type(page)].append(page)
+    for model, model_pages in pages_by_model.items():
+        for field in get_image_fields(model, fields):
+            image_ids.update(getattr(page, field.attname) for page in model_pages)
+        for relation in get_child_relations(model, fields):
+            child_model = relation.related_model
+            child_image_fields = get_image_fields(child_model, child_model.api_fields)
+            rows = child_model.objects.filter(**{
+                '%s__in' % relation.field.name: [page.id for page in model_pages]
+            }).select_related(*[field.name for field in child_image_fields])
+            for row in rows:
+                children[(getattr(row, relation.field.attname), relation.name)].append(row)
+                for field in child_image_fields:
+                    image = getattr(row, field.name)
+                    if image is not None:
+                        images_by_filter[IMAGE_FILTERS[field.name]].append(image)
+
+    image_ids.discard(None)
+    if image_ids:
+        images_by_id = WagtailImage.objects.in_bulk(image_ids)
+        for model, model_pages in pages_by_model.items():
+            for field in get_image_fields(model, fields):
+                images_by_filter[IMAGE_FILTERS[field.name]].extend(
+                    images_by_id[getattr(page, field.attname)] for page in model_pages
+                    if getattr(page, field.attname) in images_by_id)
+    for filter_spec, images in images_by_filter.items():
+        prefetch_renditions(images, responsive_filter_specs[filter_spec])
+    return children, images_by_id
+
+
+def serialize_image(request, image, field_name):
+    if image is None:
+        return None
+    return {
+        'id': image.id,
+        'title': image.title,
+        'width': image.width,
+        'height': image.height,
+        'url': request.build_absolute_uri(image.file.url),
+        'renditions': [
+            {
+                'url': request.build_absolute_uri(rendition.url),
+                'width': rendition.width,
+                'height': rendition.height,
+            }
+            for rendition in get_responsive_renditions(image, IMAGE_FILTERS[field_name])
+            if rendition.pk  # not when the original is missing
+        ],
+    }
+
+
+def serialize_child(request, child):
+    data = {'id': child.id}
+    for name in child.api_fields:
+        if is_image_field(child._meta.get_field(name)):
+            data[name] = serialize_image(request, getattr(child, name), name)
+        else:
+            data[name] = getattr(child, name)
+    return data
+
+
+def serialize_page(request, page, fields, children, images_by_id):
+    model = type(page)
+    data = {}
+    for name in fields:
+        if name not in get_fields(model):
+            continue
+        if name == 'type':
+            data[name] = get_type_name(model)
+        elif name == 'url':
+            site = getattr(request, 'site', None)
+            data[name] = request.build_absolute_uri(page.relative_url(site) if site else page.url)
+        elif name in BASE_FIELDS:
+            data[name] = getattr(page, name)
+        else:
+            field = model._meta.get_field(name)
+            if field.one_to_many:
+                data[name] = [serialize_child(request, child) for child in children[(page.id, name)]]
+            elif is_image_field(field):
+                data[name] = serialize_image(request, images_by_id.get(getattr(page, field.attname)), name)
+            elif isinstance(field, StreamField):
+                data[name] = field.stream_block.get_api_representation(getattr(page, name))
+            else:
+                data[name] = getattr(page, name)
+    return data
+
+
+def serialize_pages(request, pages, fields):
+    children, images_by_id = load_related(pages, fields)
+    return [serialize_page(request, page, fields, children, images_by_id) for page in pages]
+
+
+def get_cached_response(request, versions, get_data):
+    """
+    Return a 304 if the client has the response of ``request`` for
+    ``versions`` already, the response from the cache if it's there, or
+    the JSON of ``get_data()``, cached for the next requests. Only these
+    carry the validators, not the errors.
+    """
+    etag = get_etag(request, versions)
+    response = get_conditional_response(request, etag=etag, last_modified=get_last_modified(versions))
+    if response is None:
+        key = RESPONSE_KEY % hashlib.md5(etag.encode('utf-8')).hexdigest()
+        content = cache.get(key)
+        if content is None:
+            try:
+                content = json.dumps(get_data(), cls=DjangoJSONEncoder)
+            except BadRequest as e:
+                return JsonResponse({'message': e.args[0]}, status=400)
+            except Http404:
+                return JsonResponse({'message': 'Not found'}, status=404)
+            cache.set(key, content, get_timeout())
+        response = HttpResponse(content, content_type='application/json')
+    if response.status_code in (200, 304):  # not a 412
+        set_validators(request, response, versions)
+    return response
+
+
+@require_safe
+def page_list(request):
+    def get_data():
+        models = parse_models(request.GET.get('type'))
+        fields = parse_fields(request.GET.get('fields'), models, LISTING_FIELDS)
+        limit = parse_int(request.GET.get('limit'), 'limit', DEFAULT_LIMIT)
+        if not 0 < limit <= MAX_LIMIT:
+            raise BadRequest('limit must be between 1 and %d' % MAX_LIMIT)
+
+        pages = get_pages(request, models)
+        child_of = parse_int(request.GET.get('child_of'), 'child_of')
+        if child_of is not None:
+            parent = Page.objects.filter(id=child_of).first()
+            if parent is None:
+                raise BadRequest('There is no page %d' % child_of)
+            pages = pages.child_of(parent)
+
+        window = keyset_paginate(pages, limit, after=request.GET.get('after'))
+        return {
+            'items': serialize_pages(request, window.object_list, fields),
+            'next_cursor': window.next_cursor(),
+        }
+
+    return get_cached_response(request, get_listing_versions(), get_data)
+
+
+@require_safe
+def page_detail(request, page_id):
+    # Before reading the versions, which would be stored for any id
+    pages = get_pages(request, PAGE_MODELS).filter(id=page_id)
+    if not pages.exists():
+        return JsonResponse({'message': 'Not found'}, status=404)
+
+    def get_data():
+        page = pages.specific().first()
+        if page is None:  # unpublished in between
+            raise Http404
+        fields = parse_fields(request.GET.get('fields'), [type(page)], get_fields(type(page)))
+        return serialize_pages(request, [page], fields)[0]
+
+    return get_cached_response(request, get_versions(int(page_id)), get_data)
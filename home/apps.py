@@ -0,0 +1,11 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.apps import AppConfig
+
+
+class HomeConfig(AppConfig):
+    name = 'home'
+
+    def ready(self):
+        from home.db import register_signal_handlers
+        register_signal_handlers()
@@ -0,0 +1,16 @@
+# -*- coding: UTF-8 -*-
+"""
+Helpers shared by the benchmark_pages and load_test commands.
+"""
+from __future__ import division, unicode_literals
+
+
+def percentile(values, fraction):
+    """
+    Return the value ``fraction`` (0 to 1) of the way through the sorted
+    ``values``, 0 when there are none.
+    """
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(int(len(values) * fraction), len(values) - 1)]
@@ -0,0 +1,19 @@
+"""
+Setup of the database connections.
+"""
+from __future__ import absolute_import, unicode_literals
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    # See SQLITE_PRAGMAS in the production settings
+    if connection.vendor == 'sqlite':
+        cursor = connection.cursor()
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', ()):
+            cursor.execute('PRAGMA %s = %s' % (pragma, value))
+
+
+def register_signal_handlers():
+    connection_created.connect(configure_sqlite)
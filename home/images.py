@@ -0,0 +1,362 @@
+# -*- coding: UTF-8 -*-
+from __future__ import unicode_literals
+import hashlib
+import io
+import os
+import shutil
+from PIL import Image as PILImage
+from PIL import ExifTags
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+
+from wagtail.wagtailimages.models import Filter, Image as WagtailImage
+from wagtail.wagtailimages.shortcuts import get_rendition_or_not_found
+
+from home.page_cache import invalidate_site_cache
+
+
+# The filter specs of the renditions the site templates ask for. Their
+# renditions are generated ahead of the first page view: by the image job
+# worker when an image is saved, when a page using the image is published
+# and by the generate_renditions command.
+rendition_filter_specs = []
+
+
+def register_rendition_filter(filter_spec):
+    if filter_spec not in rendition_filter_specs:
+        rendition_filter_specs.append(filter_spec)
+    return filter_spec
+
+
+# The width ladder of every responsive filter spec, the spec and its scaled
+# copies, for the srcset of the responsive_image tag
+responsive_filter_specs = {}
+
+
+def scale_filter_spec(filter_spec, width):
+    """
+    Return ``filter_spec`` scaled to ``width``: 'fill-335x240' scaled to 670 is
+    'fill-670x480', 'width-750' scaled to 400 is 'width-400'.
+    """
+    operation, size = filter_spec.split('-', 1)
+    if operation == 'width':
+        return 'width-%d' % width
+    if operation in ('fill', 'max', 'min'):
+        spec_width, spec_height = [int(side) for side in size.split('x')]
+        return '%s-%dx%d' % (operation, width, int(round(float(spec_height) * width / spec_width)))
+    raise ValueError('Cannot scale the filter spec %s' % filter_spec)
+
+
+def register_responsive_filter(filter_spec, widths):
+    """
+    Register ``filter_spec`` and its copies scaled to ``widths`` as renditions
+    to generate ahead of time, for ``get_responsive_renditions``.
+    """
+    ladder = [filter_spec] + [
+        scale_filter_spec(filter_spec, width) for width in sorted(widths)
+    ]
+    responsive_filter_specs[filter_spec] = sorted(set(ladder), key=ladder.index)
+    for spec in responsive_filter_specs[filter_spec]:
+        register_rendition_filter(spec)
+    return filter_spec
+
+
+# The formats the responsive renditions are also converted to, most compact
+# first. Only the ones the installed Pillow can write are used: WebP needs
+# Pillow built with libwebp, AVIF the pillow-avif-plugin package.
+try:
+    import pillow_avif  # noqa, registers AVIF with Pillow
+except ImportError:
+    pass
+
+MODERN_FORMATS = [('avif', 'image/avif'), ('webp', 'image/webp')]
+MODERN_FORMAT_QUALITY = 80
+# Whether a converted rendition exists, see has_variants
+VARIANT_KEY = 'home:variant:%s'
+
+PILImage.init()
+modern_formats = [(fmt, mime_type) for fmt, mime_type in MODERN_FORMATS if fmt.upper() in PILImage.SAVE]
+
+
+def prefetch_renditions(images, filter_specs):
+    """
+    Load the existing renditions of ``images`` for ``filter_specs`` in one query
+    and attach them to the images, so that ``get_rendition`` can hand them out
+    without a query per image.
+    """
+    images = [image for image in images if image]
+    if not images:
+        return images
+
+    Rendition = WagtailImage.get_rendition_model()
+    renditions = Rendition.objects.filter(
+        image_id__in=set(image.id for image in images),
+        filter_spec__in=filter_specs,
+    )
+    renditions_by_key = {}
+    for rendition in renditions:
+        renditions_by_key[(rendition.image_id, rendition.filter_spec, rendition.focal_point_key)] = rendition
+
+    filters = [Filter(spec=filter_spec) for filter_spec in filter_specs]
+    for image in images:
+        cache = image.__dict__.setdefault('_prefetched_renditions', {})
+        for image_filter in filters:
+            key = (image.id, image_filter.spec, image_filter.get_cache_key(image))
+            rendition = renditions_by_key.get(key)
+            if rendition is not None:
+                rendition.image = image
+                cache[image_filter.spec] = rendition
+    return images
+
+
+def get_rendition(image, filter_spec):
+    """
+    Return the rendition of ``image`` for ``filter_spec``, using the renditions
+    attached by ``prefetch_renditions`` when available.
+    """
+    if not image:
+        return None
+    cache = image.__dict__.setdefault('_prefetched_renditions', {})
+    if filter_spec not in cache:
+        cache[filter_spec] = get_rendition_or_not_found(image, filter_spec)
+    return cache[filter_spec]
+
+
+def get_responsive_renditions(image, filter_spec):
+    """
+    Return the renditions of ``image`` for the width ladder of ``filter_spec``,
+    a spec registered with ``register_responsive_filter``, from narrowest to
+    widest. Images too small for the wider specs give the same rendition
+    several times, only the first one is kept.
+    """
+    renditions = []
+    for spec in responsive_filter_specs[filter_spec]:
+        rendition = get_rendition(image, spec)
+        if rendition and not any(rendition.width == kept.width for kept in renditions):
+            renditions.append(rendition)
+    return sorted(renditions, key=lambda rendition: rendition.width)
+
+
+def get_variant_name(rendition, fmt):
+    return '%s.%s' % (os.path.splitext(rendition.file.name)[0], fmt)
+
+
+def get_variant_key(name):
+    return VARIANT_KEY % hashlib.md5(name.encode('utf-8')).hexdigest()
+
+
+def has_variants(renditions, fmt):
+    """
+    Return whether all of ``renditions`` have been converted to ``fmt``. The
+    answers are cached until ``make_variant`` or ``delete_variants`` change
+    them, the storage is only asked once per file.
+    """
+    names = dict((get_variant_key(get_variant_name(rendition, fmt)), rendition) for rendition in renditions)
+    found = cache.get_many(list(names))
+    missing = dict(
+        (key, rendition.file.storage.exists(get_variant_name(rendition, fmt)))
+        for key, rendition in names.items() if key not in found)
+    if missing:
+        cache.set_many(missing, None)
+        found.update(missing)
+    return all(found.values())
+
+
+def make_variant(rendition, fmt):
+    """
+    Write ``rendition`` converted to ``fmt``, one of ``modern_formats``, next
+    to it unless it's there already. Return ``(file name, created)``.
+    """
+    storage = rendition.file.storage
+    name = get_variant_name(rendition, fmt)
+    if storage.exists(name):
+        cache.set(get_variant_key(name), True, None)
+        return name, False
+
+    rendition.file.open('rb')
+    try:
+        img = PILImage.open(rendition.file)
+        img.load()
+    finally:
+        rendition.file.close()
+    if img.mode not in ('RGB', 'RGBA'):
+        img = img.convert('RGBA' if img.mode in ('LA', 'PA') or 'transparency' in img.info else 'RGB')
+    f = io.BytesIO()
+    img.save(f, fmt.upper(), quality=MODERN_FORMAT_QUALITY)
+    name = storage.save(name, ContentFile(f.getvalue()))
+    cache.set(get_variant_key(name), True, None)
+    return name, True
+
+
+def delete_variants(rendition):
+    storage = rendition.file.storage
+    for fmt, mime_type in MODERN_FORMATS:
+        name = get_variant_name(rendition, fmt)
+        if storage.exists(name):
+            storage.delete(name)
+        cache.delete(get_variant_key(name))
+
+
+def get_missing_renditions(images):
+    """
+    Return ``(image, filter_spec)`` for every registered rendition of
+    ``images`` that hasn't been generated yet.
+    """
+    images = prefetch_renditions(images, rendition_filter_specs)
+    return [
+        (image, filter_spec)
+        for image in images
+        for filter_spec in rendition_filter_specs
+        if filter_spec not in image._prefetched_renditions
+    ]
+
+
+def generate_renditions(images):
+    """
+    Generate the registered renditions ``images`` lack and the conversions of
+    the responsive ones to ``modern_formats``, return how many files were made.
+    """
+    missing = get_missing_renditions(images)
+    for image, filter_spec in missing:
+        get_rendition(image, filter_spec)
+    generated = len(missing)
+
+    if modern_formats:
+        for image in images:
+            for filter_spec in responsive_filter_specs:
+                for rendition in get_responsive_renditions(image, filter_spec):
+                    if not rendition.pk:  # the original is missing
+                        continue
+                    for fmt, mime_type in modern_formats:
+                        generated += make_variant(rendition, fmt)[1]
+    return generated
+
+
+def get_page_images(page):
+    """
+    Return the images shown on ``page``, a specific page.
+    """
+    images = []
+    if getattr(page, 'thumbnail', None):
+        images.append(page.thumbnail)
+    if hasattr(page, 'gallery_images'):
+        images.extend(
+            gallery_image.image
+            for gallery_image in page.gallery_images.select_related('image')
+            if gallery_image.image
+        )
+    return images
+
+
+def prefetch_thumbnails(pages, filter_specs=()):
+    """
+    Resolve the ``thumbnail`` of every page in ``pages`` (specific pages, as
+    returned by ``PageQuerySet.specific()``) with one query, optionally
+    prefetching the renditions for ``filter_specs`` as well.
+    """
+    thumbnails = []
+    pages_with_thumbnail = [page for page in pages if getattr(page, 'thumbnail_id', None)]
+    if pages_with_thumbnail:
+        images = WagtailImage.objects.in_bulk(set(page.thumbnail_id for page in pages_with_thumbnail))
+        for page in pages_with_thumbnail:
+            image = images.get(page.thumbnail_id)
+            if image is not None:
+                page.thumbnail = image
+                thumbnails.append(image)
+
+    if filter_specs:
+        prefetch_renditions(thumbnails, filter_specs)
+    return pages
+
+
+for orientation in ExifTags.TAGS.keys():
+    if ExifTags.TAGS[orientation] == 'Orientation': break
+
+
+# The transposition that turns an image with the given EXIF orientation upright
+ORIENTATION_TRANSPOSES = {
+    3: PILImage.ROTATE_180,
+    6: PILImage.ROTATE_270,
+    8: PILImage.ROTATE_90,
+}
+MAX_IMAGE_WIDTH = 1080
+
+
+def get_exif_orientation(img):
+    if hasattr(img, '_getexif'):
+        # we need to rotate the image based on exif info.
+        # https://stackoverflow.com/questions/4228530/pil-thumbnail-is-rotating-my-image
+        try:
+            exif = img._getexif()
+        except Exception:  # Pillow raises all sorts of errors on broken EXIF data
+            exif = None
+        if exif:
+            return exif.get(orientation)
+
+
+def resize_image(path, max_width=MAX_IMAGE_WIDTH):
+    """
+    Rotate the image at ``path`` according to its EXIF orientation and shrink
+    it to ``max_width`` wide, in place. Return True if the file was rewritten.
+
+    Only the header is read to decide, upright images that are narrow enough
+    are left alone. Otherwise JPEGs are decoded at the smallest scale (down to
+    1/8) that is still larger than the target, and the image is resized before
+    being rotated, so the full size bitmap is never held in memory.
+    """
+    img = PILImage.open(path)
+    transpose = ORIENTATION_TRANSPOSES.get(get_exif_orientation(img))
+    swap_sides = transpose in (PILImage.ROTATE_90, PILImage.ROTATE_270)
+
+    # The size of the image once upright
+    width, height = img.size[::-1] if swap_sides else img.size
+    if width <= max_width and transpose is None:  # no need to resize
+        return False
+    if width > max_width:
+        height = int(float(height) * max_width / width)
+        width = max_width
+
+    # The size to resize to before rotating
+    size = (height, width) if swap_sides else (width, height)
+    img.draft(img.mode, size)
+    if img.size != size:
+        img = img.resize(size, PILImage.ANTIALIAS)
+    if transpose is not None:
+        img = img.transpose(transpose)
+    img.save(path)
+    return True
+
+
+def import_image_file(paths):
+    """
+    Copy the image at ``source_path`` to ``dest_path``, rotating and resizing
+    it like ``resize_image``, and return ``(dest_path, width, height, file_size)``.
+    Takes a single ``(source_path, dest_path)`` tuple so it can be mapped over
+    a multiprocessing pool.
+    """
+    source_path, dest_path = paths
+    shutil.copyfile(source_path, dest_path)
+    resize_image(dest_path)
+    width, height = PILImage.open(dest_path).size
+    return dest_path, width, height, os.path.getsize(dest_path)
+
+
+def process_image(image):
+    """
+    Resize the original of ``image`` and generate its registered renditions.
+    Runs in the image job worker, see ImageJob.
+    """
+    path = image.file.path
+    if resize_image(path):
+        width, height = PILImage.open(path).size
+        # update() so that the image post_save handler doesn't queue another job
+        WagtailImage.objects.filter(id=image.id).update(
+            width=width, height=height, file_size=os.path.getsize(path))
+        image.width, image.height = width, height
+        # Renditions made from the file before it was rotated and resized
+        image.renditions.all().delete()
+        image.__dict__.pop('_prefetched_renditions', None)
+        invalidate_site_cache()
+
+    generate_renditions([image])
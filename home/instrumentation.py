@@ -0,0 +1,60 @@
+# -*- coding: UTF-8 -*-
+"""
+Per-request timings for a sample of the requests, see InstrumentationMiddleware.
+
+Code paths worth watching are wrapped in ``timed('name')``, as a decorator or
+a ``with`` block. While a sampled request is being handled the time spent in
+them adds up under their name, and costs nothing otherwise.
+"""
+from __future__ import unicode_literals
+import functools
+import threading
+import time
+
+
+_local = threading.local()
+
+
+def start_timings():
+    _local.timings = {}
+
+
+def stop_timings():
+    """
+    Return the ``{name: (seconds, calls)}`` recorded since ``start_timings``.
+    """
+    timings = getattr(_local, 'timings', None)
+    _local.timings = None
+    return timings or {}
+
+
+def is_recording():
+    return getattr(_local, 'timings', None) is not None
+
+
+def record(name, duration):
+    timings = getattr(_local, 'timings', None)
+    if timings is not None:
+        total, calls = timings.get(name, (0, 0))
+        timings[name] = (total + duration, calls + 1)
+
+
+class timed(object):
+
+    def __init__(self, name):
+        self.name = name
+        self.started = None
+
+    def __enter__(self):
+        self.started = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        record(self.name, time.time() - self.started)
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(self.name):
+                return func(*args, **kwargs)
+        return wrapper
@@ -0,0 +1,287 @@
+from __future__ import absolute_import, division, unicode_literals
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+from PIL import Image as PILImage
+
+import django
+import wagtail
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils.six.moves.socketserver import ThreadingMixIn
+from django.utils.six.moves.urllib.request import urlopen
+
+from wagtail.wagtailcore.models import Site
+from wagtail.wagtailimages.models import Image as WagtailImage
+
+from home.benchmarking import percentile
+from home.models import CategoryPage, GalleryPage, GalleryPageGalleryImage, SimplePage
+from search.index import rebuild_index
+from search.results import invalidate_results
+
+SEARCH_WORDS = ['tree', 'photo', 'garden', '小树', '花园', '照片']
+
+
+def summarize(latencies, duration=None):
+    summary = {
+        'requests': len(latencies),
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+    }
+    if duration:
+        summary['requests_per_second'] = len(latencies) / duration
+    return summary
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Build a synthetic page tree in a separate database and measure the '
+        'latency, throughput and query counts of the home, category, detail '
+        'and search pages, through the test client and a threaded WSGI server.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=50)
+        parser.add_argument(
+            '--pages', type=int, default=10000,
+            help='Number of simple and gallery pages, spread over the categories.')
+        parser.add_argument(
+            '--images', type=int, default=20,
+            help='Number of distinct images the pages use.')
+        parser.add_argument(
+            '--requests', type=int, default=200,
+            help='Requests per page type through the test client.')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Seconds of WSGI load per page type.')
+        parser.add_argument(
+            '--keep', action='store_true',
+            help='Keep the benchmark database and reuse its tree on the next run.')
+        parser.add_argument(
+            '--output',
+            help='Write the results to this file as JSON.')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        workdir = os.path.join(settings.BASE_DIR, 'benchmark')
+        if not os.path.isdir(workdir):
+            os.makedirs(workdir)
+
+        test_settings = connection.settings_dict.setdefault('TEST', {})
+        if connection.vendor == 'sqlite':
+            # On disk, the WSGI server threads need their own connections to it
+            test_settings['NAME'] = os.path.join(workdir, 'db.sqlite3')
+        old_name = connection.settings_dict['NAME']
+
+        with override_settings(
+                ALLOWED_HOSTS=['localhost', '127.0.0.1'],
+                CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'benchmark-%s' % uuid.uuid4().hex,
+                }},
+                MEDIA_ROOT=os.path.join(workdir, 'media'),
+                SEARCH_INDEX_PATH=os.path.join(workdir, 'search_index.sqlite3')):
+            connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False, keepdb=options['keep'])
+            try:
+                if not CategoryPage.objects.exists():
+                    self.build_tree(options)
+                results = self.run_benchmarks(options)
+            finally:
+                if options['keep']:
+                    connection.close()
+                    connection.settings_dict['NAME'] = old_name
+                else:
+                    connection.creation.destroy_test_db(old_name, verbosity=0)
+                    shutil.rmtree(workdir)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def log(self, message):
+        if self.verbosity:
+            self.stdout.write(message)
+
+    def make_images(self, count):
+        images = []
+        for i in range(count):
+            f = io.BytesIO()
+            PILImage.new('RGB', (1200, 800), (random.randint(0, 255), 183, 139)).save(f, 'JPEG')
+            # Named like camera photos, gallery pages take their date from it
+            filename = 'IMG_2017-03-%02d-%02d1010.jpg' % (i % 28 + 1, i % 24)
+            image = WagtailImage(title=filename, width=1200, height=800)
+            image.file.save(filename, ContentFile(f.getvalue()), save=False)
+            image.save()
+            images.append(image)
+        return images
+
+    def build_tree(self, options):
+        started = time.time()
+        site = Site.objects.get(is_default_site=True)
+        images = self.make_images(options['images'])
+        published_at = datetime(2017, 1, 1)
+        pages_per_category = options['pages'] // options['categories']
+        for c in range(options['categories']):
+            with transaction.atomic():
+                category = CategoryPage(
+                    title='Category %d' % c, slug='category-%d' % c, show_in_menus=True,
+                    thumbnail=images[c % len(images)], intro='<p>Category %d</p>' % c)
+                site.root_page.add_child(instance=category)
+                for i in range(pages_per_category):
+                    published_at += timedelta(minutes=1)
+                    words = ' '.join(random.sample(SEARCH_WORDS, 3))
+                    if i % 2:
+                        page = GalleryPage(
+                            title='Gallery %d-%d' % (c, i), intro='<p>%s</p>' % words,
+                            gallery_images=[
+                                GalleryPageGalleryImage(image=images[(i + j) % len(images)], sort_order=j)
+                                for j in range(3)
+                            ])
+                    else:
+                        page = SimplePage(
+                            title='Article %d-%d' % (c, i), thumbnail=images[i % len(images)],
+                            intro='<p>%s</p>' % words, body='<p>%s %s</p>' % (words, words))
+                    page.slug = 'page-%d' % i
+                    page.first_published_at = page.last_published_at = published_at
+                    category.add_child(instance=page)
+            self.log('%d/%d categories, %.0fs' % (c + 1, options['categories'], time.time() - started))
+        rebuild_index()
+
+    def get_urls(self):
+        site = Site.objects.get(is_default_site=True)
+        details = list(SimplePage.objects.live()) + list(GalleryPage.objects.live())
+        return {
+            'home': ['/'],
+            'category': [page.relative_url(site) for page in CategoryPage.objects.live()],
+            'detail': [page.relative_url(site) for page in random.sample(details, min(len(details), 500))],
+            'search': ['/search/?query=%s' % word for word in ['tree', 'garden', 'photo']],
+        }
+
+    def run_benchmarks(self, options):
+        urls = self.get_urls()
+        results = {
+            'environment': {
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'wagtail': wagtail.__version__,
+                'database': connection.vendor,
+            },
+            'tree': {
+                'categories': CategoryPage.objects.count(),
+                'simple_pages': SimplePage.objects.count(),
+                'gallery_pages': GalleryPage.objects.count(),
+                'images': WagtailImage.objects.count(),
+            },
+            'client': {},
+            'wsgi': {},
+        }
+
+        client = Client(HTTP_HOST='localhost')
+        for name, scenario_urls in sorted(urls.items()):
+            # Render every page once, renditions are made on the first view
+            for url in scenario_urls:
+                client.get(url)
+            results['client'][name] = {
+                'cold': self.run_client(client, scenario_urls, options['requests'], cold=True),
+                'warm': self.run_client(client, scenario_urls, options['requests'], cold=False),
+            }
+            for state in ('cold', 'warm'):
+                self.log('client %-8s %-4s p50 %6.1f ms  p99 %6.1f ms  %5.1f queries' % (
+                    name, state, results['client'][name][state]['p50_ms'],
+                    results['client'][name][state]['p99_ms'], results['client'][name][state]['queries']))
+
+        server = make_server(
+            '127.0.0.1', 0, get_wsgi_application(),
+            server_class=ThreadingWSGIServer, handler_class=QuietWSGIRequestHandler)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.daemon = True
+        server_thread.start()
+        base_url = 'http://127.0.0.1:%d' % server.server_port
+        try:
+            for name, scenario_urls in sorted(urls.items()):
+                results['wsgi'][name] = self.run_wsgi(base_url, scenario_urls, options['threads'], options['duration'])
+                self.log('wsgi   %-8s      p50 %6.1f ms  p99 %6.1f ms  %6.1f requests/s' % (
+                    name, results['wsgi'][name]['p50_ms'], results['wsgi'][name]['p99_ms'],
+                    results['wsgi'][name]['requests_per_second']))
+        finally:
+            server.shutdown()
+            server.server_close()
+        return results
+
+    def run_client(self, client, urls, count, cold):
+        """
+        Request ``count`` of ``urls`` one after the other. Cold requests miss
+        the page cache and the search results cache, warm ones are served from
+        them.
+        """
+        latencies = []
+        queries = 0
+        for i in range(count):
+            url = random.choice(urls)
+            if cold:
+                url += '%sbenchmark=%s' % ('&' if '?' in url else '?', uuid.uuid4().hex)
+                invalidate_results()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.time()
+                client.get(url)
+                latencies.append(time.time() - started)
+            queries += len(captured.captured_queries)
+        summary = summarize(latencies)
+        summary['queries'] = queries / count
+        return summary
+
+    def run_wsgi(self, base_url, urls, threads, duration):
+        deadline = time.time() + duration
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def worker():
+            thread_latencies = []
+            thread_errors = 0
+            while time.time() < deadline:
+                started = time.time()
+                try:
+                    urlopen(base_url + random.choice(urls)).read()
+                    thread_latencies.append(time.time() - started)
+                except IOError:
+                    thread_errors += 1
+            with lock:
+                latencies.extend(thread_latencies)
+                errors.append(thread_errors)
+
+        workers = [threading.Thread(target=worker) for i in range(threads)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        summary = summarize(latencies, duration)
+        summary['threads'] = threads
+        summary['errors'] = sum(errors)
+        return summary
@@ -0,0 +1,126 @@
+from __future__ import absolute_import, division, unicode_literals
+import json
+import os
+import resource
+import shutil
+import struct
+import tempfile
+import time
+from multiprocessing import Process, Queue
+
+from PIL import Image as PILImage
+
+from django.core.management.base import BaseCommand
+
+from home.images import orientation, resize_image
+
+
+def legacy_resize_image(path):
+    """
+    resize_image as it was before the draft mode decoding: full size decode,
+    rotate with expand=True, then resize.
+    """
+    max_width = 1080
+    img = PILImage.open(path)
+    exif = img._getexif() or {}
+    if exif.get(orientation) == 3:
+        img = img.rotate(180, expand=True)
+    elif exif.get(orientation) == 6:
+        img = img.rotate(270, expand=True)
+    elif exif.get(orientation) == 8:
+        img = img.rotate(90, expand=True)
+    original_width, original_height = img.size
+    if original_width < max_width:
+        return
+    width_percent = (max_width / float(original_width))
+    new_height = int((float(original_height) * float(width_percent)))
+    img = img.resize((max_width, new_height), PILImage.ANTIALIAS)
+    img.save(path)
+
+
+IMPLEMENTATIONS = [
+    ('legacy', legacy_resize_image),
+    ('resize_image', resize_image),
+]
+
+
+def measure(function, path, queue):
+    # Runs in a fresh process so that ru_maxrss only covers this resize
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.time()
+    function(path)
+    elapsed = time.time() - started
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    queue.put((elapsed, baseline, peak))
+
+
+class Command(BaseCommand):
+    help = 'Compare the peak memory and latency of the image resizing implementations.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--megapixels', type=float, default=40,
+            help='Size of the generated test photo.')
+        parser.add_argument(
+            '--orientation', type=int, default=6, choices=[1, 3, 6, 8],
+            help='EXIF orientation of the generated test photo.')
+        parser.add_argument(
+            '--image',
+            help='Use this photo instead of generating one.')
+        parser.add_argument('--repeat', type=int, default=3)
+        parser.add_argument(
+            '--output',
+            help='Write the results to this file as JSON.')
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp()
+        try:
+            source = options['image'] or self.make_photo(workdir, options['megapixels'], options['orientation'])
+            results = {
+                'image': source if options['image'] else None,
+                'size': PILImage.open(source).size,
+                'implementations': {},
+            }
+            for name, function in IMPLEMENTATIONS:
+                runs = []
+                for i in range(options['repeat']):
+                    path = os.path.join(workdir, 'run.jpg')
+                    shutil.copyfile(source, path)
+                    queue = Queue()
+                    process = Process(target=measure, args=(function, path, queue))
+                    process.start()
+                    elapsed, baseline, peak = queue.get()
+                    process.join()
+                    runs.append({
+                        'seconds': elapsed,
+                        # ru_maxrss is in kilobytes on Linux
+                        'peak_rss_mb': peak / 1024,
+                        'added_rss_mb': (peak - baseline) / 1024,
+                    })
+                results['implementations'][name] = {
+                    'runs': runs,
+                    'best_seconds': min(run['seconds'] for run in runs),
+                    'max_added_rss_mb': max(run['added_rss_mb'] for run in runs),
+                }
+                self.stdout.write('%-14s %.3fs  +%.1f MB peak RSS' % (
+                    name,
+                    results['implementations'][name]['best_seconds'],
+                    results['implementations'][name]['max_added_rss_mb'],
+                ))
+        finally:
+            shutil.rmtree(workdir)
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+    def make_photo(self, workdir, megapixels, exif_orientation):
+        width = int((megapixels * 1000000 * 3 / 2) ** 0.5)
+        height = int(width * 2 / 3)
+        img = PILImage.new('RGB', (width, height), (68, 183, 139))
+        # A big-endian TIFF header and an IFD holding the orientation only
+        exif = b'Exif\x00\x00MM\x00\x2a\x00\x00\x00\x08' + struct.pack(
+            '>HHHIHHI', 1, orientation, 3, 1, exif_orientation, 0, 0)
+        path = os.path.join(workdir, 'source.jpg')
+        img.save(path, quality=90, exif=exif)
+        return path
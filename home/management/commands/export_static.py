@@ -0,0 +1,183 @@
+from __future__ import absolute_import, unicode_literals
+import json
+import os
+import re
+import shutil
+import time
+from multiprocessing import Pool, cpu_count
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.test import Client
+from django.test.utils import override_settings
+from django.utils.six.moves.urllib.parse import unquote
+
+from wagtail.wagtailcore.models import Site
+
+from home.models import CategoryPage
+from home.page_cache import get_versions
+
+MANIFEST_NAME = '.export-manifest.json'
+MEDIA_URL_RE = re.compile(r'%s[^"\'\s<>(),]+' % re.escape(settings.MEDIA_URL))
+
+
+def export_page(args):
+    """
+    Render the page at ``url`` and the windows of its sub pages into
+    ``output_dir``, return ``(page_id, file names, media urls, error)``.
+    Takes a single tuple so it can be mapped over a multiprocessing pool.
+    """
+    page_id, url, paginated, hostname, output_dir = args
+    directory = os.path.join(output_dir, url.strip('/'))
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    files = []
+    media_urls = set()
+    queue = [('', 'index.html')]
+    if paginated:
+        queue.append(('format=json', 'index.json'))
+
+    client = Client(HTTP_HOST=hostname)
+    with override_settings(ALLOWED_HOSTS=[hostname]):
+        while queue:
+            query_string, filename = queue.pop(0)
+            response = client.get(url, QUERY_STRING=query_string)
+            if response.status_code != 200:
+                return page_id, files, media_urls, '%s?%s returned %d' % (url, query_string, response.status_code)
+            content = response.content
+            with open(os.path.join(directory, filename), 'wb') as f:
+                f.write(content)
+            files.append(filename)
+            media_urls.update(MEDIA_URL_RE.findall(content.decode(response.charset)))
+
+            # Follow the cursors of the JSON fragments to the next windows
+            if filename.endswith('.json'):
+                cursor = json.loads(content.decode(response.charset))['next_cursor']
+                if cursor:
+                    queue.append(('after=%s' % cursor, 'after-%s.html' % cursor))
+                    queue.append(('after=%s&format=json' % cursor, 'after-%s.json' % cursor))
+    return page_id, files, media_urls, None
+
+
+class Command(BaseCommand):
+    help = (
+        'Render the live pages of a site into a directory of static files a web '
+        'server can serve, only re-rendering the pages that changed since the '
+        'last export. Telling them apart needs a cache shared with the web '
+        'processes, with the local memory cache every page is rendered again.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('output_dir')
+        parser.add_argument(
+            '--site',
+            help='Hostname of the site to export, defaults to the default site.')
+        parser.add_argument(
+            '--workers', type=int, default=cpu_count(),
+            help='Number of processes rendering the pages.')
+        parser.add_argument(
+            '--full', action='store_true',
+            help='Render every page, even the ones that did not change.')
+
+    def handle(self, *args, **options):
+        site = self.get_site(options['site'])
+        output_dir = os.path.abspath(options['output_dir'])
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+
+        manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+        manifest = {}
+        if os.path.exists(manifest_path) and not options['full']:
+            with open(manifest_path) as f:
+                manifest = json.load(f)
+
+        pages = site.root_page.get_descendants(inclusive=True).live().specific()
+        new_manifest = {}
+        jobs = []
+        unchanged = 0
+        for page in pages:
+            url = page.relative_url(site)
+            # The page cache versions change whenever something the page
+            # shows does, see home.page_cache.invalidate_page_cache
+            versions = list(get_versions(page.id))
+            entry = manifest.get(str(page.id))
+            if entry and entry['url'] == url and entry['versions'] == versions:
+                new_manifest[str(page.id)] = entry
+                unchanged += 1
+                continue
+            new_manifest[str(page.id)] = {'url': url, 'versions': versions, 'files': []}
+            jobs.append((page.id, url, isinstance(page, CategoryPage), site.hostname, output_dir))
+
+        started = time.time()
+        media_urls = set()
+        # The workers open their own connections, don't let them share ours
+        connections.close_all()
+        pool = Pool(options['workers'])
+        try:
+            for count, (page_id, files, page_media_urls, error) in enumerate(
+                    pool.imap_unordered(export_page, jobs), 1):
+                if error:
+                    # Left out of the manifest, retried on the next export
+                    self.stderr.write('Skipped page %d: %s' % (page_id, error))
+                    del new_manifest[str(page_id)]
+                else:
+                    new_manifest[str(page_id)]['files'] = files
+                media_urls.update(page_media_urls)
+                if count % 10 == 0 or count == len(jobs):
+                    self.stdout.write('%d/%d pages, %.1f pages/s' % (
+                        count, len(jobs), count / (time.time() - started)))
+        finally:
+            pool.close()
+            pool.join()
+
+        self.remove_stale_files(output_dir, manifest, new_manifest)
+        copied = self.copy_media(output_dir, media_urls)
+
+        with open(manifest_path, 'w') as f:
+            json.dump(new_manifest, f)
+        self.stdout.write('%d pages rendered, %d unchanged, %d media files copied to %s' % (
+            len(jobs), unchanged, copied, output_dir))
+
+    def get_site(self, hostname):
+        try:
+            if hostname:
+                return Site.objects.get(hostname=hostname)
+            return Site.objects.get(is_default_site=True)
+        except Site.DoesNotExist:
+            raise CommandError('There is no site %s' % (hostname or 'marked as the default'))
+
+    def remove_stale_files(self, output_dir, manifest, new_manifest):
+        """
+        Delete the files of the pages that were unpublished, deleted or moved,
+        and the windows of sub pages that no longer exist.
+        """
+        kept = set(
+            os.path.join(entry['url'].strip('/'), filename)
+            for entry in new_manifest.values() for filename in entry['files']
+        )
+        for entry in manifest.values():
+            for filename in entry['files']:
+                path = os.path.join(entry['url'].strip('/'), filename)
+                if path not in kept and os.path.exists(os.path.join(output_dir, path)):
+                    os.remove(os.path.join(output_dir, path))
+
+    def copy_media(self, output_dir, media_urls):
+        """
+        Copy the images and renditions the pages show, return how many were copied.
+        """
+        copied = 0
+        for url in media_urls:
+            name = unquote(url[len(settings.MEDIA_URL):])
+            source = os.path.join(settings.MEDIA_ROOT, name)
+            dest = os.path.join(output_dir, settings.MEDIA_URL.strip('/'), name)
+            if not os.path.exists(source):
+                continue
+            if os.path.exists(dest) and os.path.getmtime(dest) >= os.path.getmtime(source):
+                continue
+            if not os.path.isdir(os.path.dirname(dest)):
+                os.makedirs(os.path.dirname(dest))
+            shutil.copy2(source, dest)
+            copied += 1
+        return copied
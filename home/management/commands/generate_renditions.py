@@ -0,0 +1,25 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from wagtail.wagtailimages.models import Image as WagtailImage
+
+from home.images import generate_renditions, rendition_filter_specs
+
+
+class Command(BaseCommand):
+    help = 'Generate the renditions the templates use for every image that lacks them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        image_ids = list(WagtailImage.objects.order_by('id').values_list('id', flat=True))
+        generated = 0
+        for start in range(0, len(image_ids), batch_size):
+            images = list(WagtailImage.objects.filter(id__in=image_ids[start:start + batch_size]))
+            generated += generate_renditions(images)
+            self.stdout.write('%d/%d images, %d renditions generated' % (
+                min(start + batch_size, len(image_ids)), len(image_ids), generated))
+        self.stdout.write('Filter specs: %s' % ', '.join(rendition_filter_specs))
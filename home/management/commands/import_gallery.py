@@ -0,0 +1,152 @@
+from __future__ import absolute_import, unicode_literals
+import os
+import time
+from multiprocessing import Pool, cpu_count
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections, transaction
+from django.utils.text import slugify
+
+from wagtail.wagtailimages.models import Image as WagtailImage
+
+from home.images import import_image_file
+from home.models import CategoryPage, GalleryPage, GalleryPageGalleryImage, ImageJob
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.gif')
+
+
+class Command(BaseCommand):
+    help = (
+        'Import a directory of photos into a new or existing gallery page, '
+        'resizing them in a process pool.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory')
+        parser.add_argument(
+            '--page', type=int,
+            help='Id of the gallery page to append the photos to.')
+        parser.add_argument(
+            '--parent', type=int,
+            help='Id of the category page to create a new gallery page in.')
+        parser.add_argument(
+            '--title',
+            help='Title of the new gallery page, defaults to the directory name.')
+        parser.add_argument(
+            '--workers', type=int, default=cpu_count(),
+            help='Number of processes resizing the photos.')
+        parser.add_argument(
+            '--publish', action='store_true',
+            help='Publish the gallery page once the photos are imported.')
+
+    def handle(self, *args, **options):
+        directory = os.path.abspath(options['directory'])
+        if not os.path.isdir(directory):
+            raise CommandError('%s is not a directory' % directory)
+        filenames = sorted(
+            filename for filename in os.listdir(directory)
+            if filename.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not filenames:
+            raise CommandError('No images found in %s' % directory)
+
+        page = self.get_page(directory, options)
+
+        # Reserve the storage names up front with empty files, the workers
+        # then write the resized photos over them.
+        names = [
+            default_storage.save(WagtailImage().get_upload_to(filename), ContentFile(b''))
+            for filename in filenames
+        ]
+
+        jobs = [
+            (os.path.join(directory, filename), default_storage.path(name))
+            for filename, name in zip(filenames, names)
+        ]
+        processed = {}
+        started = time.time()
+        # The workers only touch files, don't let them inherit open connections
+        connections.close_all()
+        pool = Pool(options['workers'])
+        try:
+            for count, result in enumerate(pool.imap_unordered(import_image_file, jobs), 1):
+                processed[result[0]] = result[1:]
+                if count % 10 == 0 or count == len(jobs):
+                    elapsed = time.time() - started
+                    self.stdout.write('%d/%d images, %.1f images/s' % (count, len(jobs), count / elapsed))
+        finally:
+            pool.close()
+            pool.join()
+
+        with transaction.atomic():
+            WagtailImage.objects.bulk_create([
+                WagtailImage(
+                    title=os.path.splitext(filename)[0],
+                    file=name,
+                    width=processed[default_storage.path(name)][0],
+                    height=processed[default_storage.path(name)][1],
+                    file_size=processed[default_storage.path(name)][2],
+                )
+                for filename, name in zip(filenames, names)
+            ], batch_size=500)
+            image_ids = dict(WagtailImage.objects.filter(file__in=names).values_list('file', 'id'))
+
+            # The files are already resized, the job only has the renditions to make
+            ImageJob.objects.bulk_create(
+                [ImageJob(image_id=image_ids[name]) for name in names], batch_size=500)
+
+            # The photos are added to a new revision made from the latest one,
+            # like an edit in the admin: a newer draft is kept, and the live
+            # page, its caches and its category only change when it's published.
+            page = page.get_latest_revision_as_page()
+            sort_orders = [
+                gallery_image.sort_order for gallery_image in page.gallery_images.all()
+                if gallery_image.sort_order is not None
+            ]
+            first_sort_order = max(sort_orders) + 1 if sort_orders else 0
+            page.gallery_images.add(*[
+                GalleryPageGalleryImage(image_id=image_ids[name], sort_order=first_sort_order + i)
+                for i, name in enumerate(names)
+            ])
+            revision = page.save_revision()
+            if options['publish']:
+                revision.publish()
+
+        elapsed = time.time() - started
+        self.stdout.write('Imported %d images into "%s" (id %d) in %.1fs, %.1f images/s' % (
+            len(names), page.title, page.id, elapsed, len(names) / elapsed))
+
+    def get_unique_slug(self, parent, title):
+        """
+        Return the slug of ``title``, 'gallery' for titles with no latin
+        letters or digits, followed by a number when a sibling has it already.
+        """
+        base = slugify(title) or 'gallery'
+        taken = set(parent.get_children().filter(slug__startswith=base).values_list('slug', flat=True))
+        slug = base
+        number = 1
+        while slug in taken:
+            number += 1
+            slug = '%s-%d' % (base, number)
+        return slug
+
+    def get_page(self, directory, options):
+        if options['page']:
+            try:
+                return GalleryPage.objects.get(id=options['page'])
+            except GalleryPage.DoesNotExist:
+                raise CommandError('There is no gallery page with id %d' % options['page'])
+
+        if not options['parent']:
+            raise CommandError('Either --page or --parent is required')
+        try:
+            parent = CategoryPage.objects.get(id=options['parent'])
+        except CategoryPage.DoesNotExist:
+            raise CommandError('There is no category page with id %d' % options['parent'])
+
+        title = options['title'] or os.path.basename(directory)
+        page = GalleryPage(title=title, slug=self.get_unique_slug(parent, title), live=False)
+        parent.add_child(instance=page)
+        return page
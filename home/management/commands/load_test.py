@@ -0,0 +1,119 @@
+from __future__ import absolute_import, division, unicode_literals
+import json
+import random
+import threading
+import time
+import uuid
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from django.db.utils import OperationalError
+from django.test import Client
+from django.test.utils import override_settings
+
+from wagtail.wagtailcore.models import Site
+from wagtail.wagtailsearch.models import Query
+
+from home.benchmarking import percentile
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the throughput of the site with concurrent readers and writers '
+        'against the configured database. Run it with each settings module to '
+        'compare them.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url', action='append', dest='urls',
+            help='Page to read, can be repeated. Defaults to the live pages.')
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument(
+            '--duration', type=float, default=10,
+            help='Seconds to run for.')
+        parser.add_argument(
+            '--write-ratio', type=float, default=0.2,
+            help='Share of the operations that record a search hit, like the search view used to.')
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Make every read miss the page cache.')
+        parser.add_argument(
+            '--output',
+            help='Write the results to this file as JSON.')
+
+    def handle(self, *args, **options):
+        site = Site.objects.get(is_default_site=True)
+        urls = options['urls'] or [
+            page.relative_url(site) for page in site.root_page.get_descendants(inclusive=True).live()
+        ]
+        deadline = time.time() + options['duration']
+        lock = threading.Lock()
+        stats = {'reads': [], 'writes': [], 'errors': 0}
+
+        def worker():
+            client = Client(HTTP_HOST=site.hostname)
+            reads, writes, errors = [], [], 0
+            while time.time() < deadline:
+                started = time.time()
+                try:
+                    if random.random() < options['write_ratio']:
+                        close_old_connections()
+                        Query.get('load test %d' % random.randint(0, 100)).add_hit()
+                        writes.append(time.time() - started)
+                    else:
+                        url = random.choice(urls)
+                        if options['cold']:
+                            url += '?load-test=%s' % uuid.uuid4().hex
+                        response = client.get(url)
+                        if response.status_code != 200:
+                            errors += 1
+                        else:
+                            reads.append(time.time() - started)
+                except OperationalError:  # database is locked
+                    errors += 1
+            connection.close()
+            with lock:
+                stats['reads'].extend(reads)
+                stats['writes'].extend(writes)
+                stats['errors'] += errors
+
+        with override_settings(ALLOWED_HOSTS=[site.hostname]):
+            threads = [threading.Thread(target=worker) for i in range(options['threads'])]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        settings_dict = connection.settings_dict
+        results = {
+            'database': {
+                'vendor': connection.vendor,
+                'conn_max_age': settings_dict['CONN_MAX_AGE'],
+                'options': settings_dict['OPTIONS'],
+            },
+            'threads': options['threads'],
+            'duration': options['duration'],
+            'requests_per_second': (len(stats['reads']) + len(stats['writes'])) / options['duration'],
+            'reads': len(stats['reads']),
+            'writes': len(stats['writes']),
+            'errors': stats['errors'],
+            'read_p50_ms': percentile(stats['reads'], 0.5) * 1000,
+            'read_p95_ms': percentile(stats['reads'], 0.95) * 1000,
+            'write_p50_ms': percentile(stats['writes'], 0.5) * 1000,
+            'write_p95_ms': percentile(stats['writes'], 0.95) * 1000,
+        }
+        if connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('PRAGMA journal_mode')
+                results['database']['journal_mode'] = cursor.fetchone()[0]
+
+        self.stdout.write(json.dumps(results['database']))
+        self.stdout.write('%.1f requests/s, %d reads, %d writes, %d errors' % (
+            results['requests_per_second'], results['reads'], results['writes'], results['errors']))
+        self.stdout.write('reads p50 %.1f ms p95 %.1f ms, writes p50 %.1f ms p95 %.1f ms' % (
+            results['read_p50_ms'], results['read_p95_ms'], results['write_p50_ms'], results['write_p95_ms']))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
@@ -0,0 +1,29 @@
+from __future__ import absolute_import, division, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from home.page_cache import get_stats, invalidate_site_cache, reset_stats
+
+
+class Command(BaseCommand):
+    help = 'Show the hit and miss counts of the rendered page cache.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--reset', action='store_true',
+            help='Set the counters back to zero.')
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Invalidate every cached page.')
+
+    def handle(self, *args, **options):
+        hits, misses = get_stats()
+        total = hits + misses
+        self.stdout.write('hits: %d' % hits)
+        self.stdout.write('misses: %d' % misses)
+        self.stdout.write('hit ratio: %.1f%%' % (100 * hits / total if total else 0))
+
+        if options['reset']:
+            reset_stats()
+        if options['clear']:
+            invalidate_site_cache()
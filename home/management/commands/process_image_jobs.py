@@ -0,0 +1,50 @@
+from __future__ import absolute_import, unicode_literals
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Count
+
+from home.models import ImageJob
+
+
+class Command(BaseCommand):
+    help = 'Run the worker that rotates, resizes and renders uploaded images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Exit once there are no due jobs left instead of waiting for new ones.')
+        parser.add_argument(
+            '--sleep', type=float, default=2,
+            help='Seconds to wait between polls when the queue is empty.')
+        parser.add_argument(
+            '--status', action='store_true',
+            help='Print the number of jobs in each status and exit.')
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help='Put the failed jobs back in the queue before starting.')
+
+    def handle(self, *args, **options):
+        if options['status']:
+            counts = ImageJob.objects.values_list('status').annotate(count=Count('id'))
+            for status, count in sorted(counts):
+                self.stdout.write('%s: %d' % (status, count))
+            return
+
+        if options['retry_failed']:
+            failed = ImageJob.objects.filter(status=ImageJob.STATUS_FAILED)
+            for job in failed:
+                job.retry()
+            self.stdout.write('Queued %d failed jobs again' % len(failed))
+
+        while True:
+            job = ImageJob.objects.claim_next()
+            if job is None:
+                if options['once']:
+                    break
+                time.sleep(options['sleep'])
+                continue
+
+            started = time.time()
+            job.run()
+            self.stdout.write('%s in %.2fs' % (job, time.time() - started))
@@ -0,0 +1,109 @@
+from __future__ import absolute_import, division, unicode_literals
+import json
+import logging
+import random
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from home.instrumentation import is_recording, record, start_timings, stop_timings
+from home.page_cache import cache_response, get_cached_response
+
+logger = logging.getLogger('home.instrumentation')
+
+
+class PageCacheMiddleware(object):
+    """
+    Serve the pages anonymous visitors ask for from the rendered HTML cache,
+    and fill it with the responses of pages marked cacheable by the
+    before_serve_page hook in home.wagtail_hooks.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # Media files are never pages, and reading the user of their requests
+        # would make them vary with the session cookie
+        if request.path.startswith(settings.MEDIA_URL):
+            return self.get_response(request)
+        if request.method not in ('GET', 'HEAD') or request.user.is_authenticated:
+            return self.get_response(request)
+
+        response = get_cached_response(request)
+        if response is not None:
+            return response
+
+        response = self.get_response(request)
+        page_id = getattr(request, 'page_cache_page_id', None)
+        if page_id and response.status_code == 200 and not response.streaming and not response.cookies:
+            cache_response(request, page_id, response)
+        return response
+
+
+class InstrumentationMiddleware(object):
+    """
+    Time a sample of the requests, ``INSTRUMENTATION_SAMPLE_RATE`` of them:
+    the queries and the time spent in the database, the template rendering
+    and the code paths wrapped in ``home.instrumentation.timed``. The timings
+    are sent in a Server-Timing header and logged to ``home.instrumentation``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 0)
+        if not sample_rate or random.random() >= sample_rate:
+            return self.get_response(request)
+
+        # Have the connections log their queries, with their duration
+        debug_cursors = {}
+        for connection in connections.all():
+            debug_cursors[connection.alias] = connection.force_debug_cursor, len(connection.queries_log)
+            connection.force_debug_cursor = True
+
+        start_timings()
+        started = time.time()
+        try:
+            response = self.get_response(request)
+        finally:
+            total = time.time() - started
+            timings = stop_timings()
+            queries = []
+            for connection in connections.all():
+                force_debug_cursor, first_query = debug_cursors.get(connection.alias, (False, 0))
+                queries.extend(list(connection.queries_log)[first_query:])
+                connection.force_debug_cursor = force_debug_cursor
+                if not connection.force_debug_cursor and not settings.DEBUG:
+                    connection.queries_log.clear()
+
+        db_time = sum(float(query['time']) for query in queries)
+        metrics = [('total', total, None), ('db', db_time, '%d queries' % len(queries))]
+        metrics.extend(
+            (name, duration, '%d calls' % calls if calls > 1 else None)
+            for name, (duration, calls) in sorted(timings.items())
+        )
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f%s' % (name, duration * 1000, ';desc="%s"' % desc if desc else '')
+            for name, duration, desc in metrics
+        )
+        logger.info(json.dumps({
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'page_cache': response.get('X-Page-Cache'),
+            'total_ms': round(total * 1000, 1),
+            'queries': len(queries),
+            'db_ms': round(db_time * 1000, 1),
+            'timings_ms': dict(
+                (name, round(duration * 1000, 1)) for name, (duration, calls) in timings.items()),
+        }, sort_keys=True))
+        return response
+
+    def process_template_response(self, request, response):
+        if is_recording():
+            started = time.time()
+            response.add_post_render_callback(lambda response: record('render', time.time() - started))
+        return response
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def set_thumbnails(apps, schema_editor):
+    GalleryPage = apps.get_model('home', 'GalleryPage')
+    GalleryPageGalleryImage = apps.get_model('home', 'GalleryPageGalleryImage')
+
+    thumbnail_ids = {}
+    gallery_images = GalleryPageGalleryImage.objects.order_by('page_id', 'sort_order').values_list('page_id', 'image_id')
+    for page_id, image_id in gallery_images:
+        thumbnail_ids.setdefault(page_id, image_id)
+    for page_id, image_id in thumbnail_ids.items():
+        if image_id:
+            GalleryPage.objects.filter(page_ptr_id=page_id).update(thumbnail_id=image_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0019_delete_filter'),
+        ('home', '0008_imagejob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='gallerypage',
+            name='thumbnail',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image'),
+        ),
+        migrations.RunPython(set_thumbnails, migrations.RunPython.noop),
+    ]
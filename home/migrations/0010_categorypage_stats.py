@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+from django.db.models import Count, Max
+import django.db.models.deletion
+
+
+def set_stats(apps, schema_editor):
+    Page = apps.get_model('wagtailcore', 'Page')
+    CategoryPage = apps.get_model('home', 'CategoryPage')
+    GalleryPage = apps.get_model('home', 'GalleryPage')
+    SimplePage = apps.get_model('home', 'SimplePage')
+
+    for category in CategoryPage.objects.all():
+        sub_pages = Page.objects.filter(path__startswith=category.path, depth=category.depth + 1, live=True)
+        aggregates = sub_pages.aggregate(count=Count('id'), last_published_at=Max('last_published_at'))
+        newest = sub_pages.order_by('-first_published_at', '-id').values_list('id', flat=True).first()
+        cover_id = None
+        if newest:
+            for model in (GalleryPage, SimplePage):
+                thumbnail_ids = model.objects.filter(page_ptr_id=newest).values_list('thumbnail_id', flat=True)
+                cover_id = cover_id or thumbnail_ids.first()
+        CategoryPage.objects.filter(page_ptr_id=category.page_ptr_id).update(
+            has_gallery=GalleryPage.objects.filter(page_ptr__in=sub_pages).exists(),
+            live_sub_page_count=aggregates['count'],
+            last_sub_page_published_at=aggregates['last_published_at'],
+            cover_id=cover_id,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('wagtailimages', '0019_delete_filter'),
+        ('home', '0009_gallerypage_thumbnail'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='categorypage',
+            name='cover',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='wagtailimages.Image', verbose_name='\u5c01\u9762'),
+        ),
+        migrations.AddField(
+            model_name='categorypage',
+            name='has_gallery',
+            field=models.BooleanField(default=False, editable=False, verbose_name='\u5305\u542b\u56fe\u7247\u9875\u9762'),
+        ),
+        migrations.AddField(
+            model_name='categorypage',
+            name='last_sub_page_published_at',
+            field=models.DateTimeField(blank=True, editable=False, null=True, verbose_name='\u6700\u8fd1\u53d1\u5e03\u65f6\u95f4'),
+        ),
+        migrations.AddField(
+            model_name='categorypage',
+            name='live_sub_page_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='\u5b50\u9875\u9762\u6570'),
+        ),
+        migrations.RunPython(set_stats, migrations.RunPython.noop),
+    ]
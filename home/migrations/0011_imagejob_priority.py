@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.6
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('home', '0010_categorypage_stats'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imagejob',
+            name='priority',
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -1,13 +1,19 @@
 # -*- coding: UTF-8 -*-
 from __future__ import unicode_literals
-from datetime import datetime
-from PIL import Image as PILImage
-from PIL import ExifTags
+from datetime import datetime, timedelta
+import traceback
 
+from django.conf import settings
 from django.db import models
-from django.db.models.signals import post_save
-
-from wagtail.wagtailcore.models import Page, Orderable
+from django.db.models import Count, F, Max, Q
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.http import JsonResponse
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.encoding import python_2_unicode_compatible
+
+from wagtail.wagtailcore.models import Page, Orderable, PageViewRestriction
+from wagtail.wagtailcore.signals import page_published, page_unpublished
 from wagtail.wagtailcore.fields import RichTextField, StreamField
 from wagtail.wagtailadmin.edit_handlers import FieldPanel, InlinePanel, StreamFieldPanel
 from wagtail.wagtailimages.edit_handlers import ImageChooserPanel
@@ -17,6 +23,14 @@ from wagtail.wagtailcore.blocks import TextBlock, StructBlock, StreamBlock, Fiel
 
 from modelcluster.fields import ParentalKey
 
+from home.images import (
+    delete_variants, get_missing_renditions, get_page_images, prefetch_renditions, prefetch_thumbnails,
+    process_image, register_rendition_filter, register_responsive_filter, responsive_filter_specs)
+from home.instrumentation import timed
+from home.neighbors import StaleSiblingIndex, get_neighbor, get_parent_path, invalidate_sibling_index
+from home.page_cache import invalidate_page_cache, invalidate_page_versions, invalidate_site_cache
+from home.pagination import keyset_paginate
+
 
 # Stream Field
 
@@ -68,6 +82,19 @@ class HomePage(Page):
     subpage_types = ['CategoryPage']
     parent_page_types = []
 
+    # The rendition the home page shows for each category
+    category_thumbnail_filter = register_rendition_filter('fill-180x180')
+
+    def get_context(self, request, *args, **kwargs):
+        context = super(HomePage, self).get_context(request, *args, **kwargs)
+        # The categories carry their statistics and cover, no sub page is read
+        categories = list(CategoryPage.objects.child_of(self).live().select_related('thumbnail', 'cover'))
+        for category in categories:
+            category.card_image = category.thumbnail or category.cover
+        prefetch_renditions([category.card_image for category in categories], [self.category_thumbnail_filter])
+        context['categories'] = categories
+        return context
+
     class Meta:
         verbose_name = u'主页'
 
@@ -94,23 +121,118 @@ class CategoryPage(Page):
         related_name='+'
     )
 
+    # Kept up to date as the sub pages are published, unpublished, moved and
+    # deleted, see update_stats
+    has_gallery = models.BooleanField(
+        verbose_name=u'包含图片页面',
+        default=False,
+        editable=False
+    )
+    live_sub_page_count = models.PositiveIntegerField(
+        verbose_name=u'子页面数',
+        default=0,
+        editable=False
+    )
+    last_sub_page_published_at = models.DateTimeField(
+        verbose_name=u'最近发布时间',
+        null=True,
+        blank=True,
+        editable=False
+    )
+    # The thumbnail of the newest sub page
+    cover = models.ForeignKey(
+        'wagtailimages.Image',
+        verbose_name=u'封面',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
+
     search_fields = Page.search_fields + [
         index.SearchField('intro'),
     ]
 
-    api_fields = ['intro', 'thumbnail']
+    api_fields = ['intro', 'thumbnail', 'live_sub_page_count', 'last_sub_page_published_at', 'cover']
 
     subpage_types = ['GalleryPage', 'SimplePage']
 
+    # The rendition the category templates show for each sub page, and its
+    # double width one for high density screens
+    sub_page_thumbnail_filter = register_responsive_filter('fill-335x240', [670])
+    sub_pages_per_page = 24
+
+    # The sub page cards of each category template, served on their own to
+    # the infinite scroll with ?format=json
+    fragment_templates = {
+        'home/category_page.html': 'pages/includes/category_cards.html',
+        'home/category_page_simple.html': 'pages/includes/category_cards_simple.html',
+    }
+
+    @timed('get_template')
     def get_template(self, request):
-        if self.get_children().live().filter(gallerypage__isnull=False).exists():
+        if self.has_gallery:
             return 'home/category_page.html'
         else:
             return 'home/category_page_simple.html'
 
-    @property
-    def sub_pages(self):
-        return self.get_children().live().order_by('-first_published_at')
+    def get_stats(self):
+        sub_pages = self.get_children().live()
+        aggregates = sub_pages.aggregate(count=Count('id'), last_published_at=Max('last_published_at'))
+        newest = sub_pages.order_by('-first_published_at', '-id').specific().first()
+        return {
+            'has_gallery': sub_pages.filter(gallerypage__isnull=False).exists(),
+            'live_sub_page_count': aggregates['count'],
+            'last_sub_page_published_at': aggregates['last_published_at'],
+            'cover_id': getattr(newest, 'thumbnail_id', None),
+        }
+
+    def update_stats(self):
+        """
+        Recompute the sub page statistics and write them without saving the
+        whole page, which would make a revision of it stale. Return whether
+        they changed.
+        """
+        stats = self.get_stats()
+        changed = dict(
+            (field_name, value) for field_name, value in stats.items()
+            if getattr(self, field_name) != value)
+        if not changed:
+            return False
+        CategoryPage.objects.filter(id=self.id).update(**changed)
+        for field_name, value in changed.items():
+            setattr(self, field_name, value)
+        # The category and the home page listing it show them
+        page_ids = set(Page.objects.filter(path=get_parent_path(self)).values_list('id', flat=True))
+        page_ids.add(self.id)
+        invalidate_page_versions(page_ids)
+        return True
+
+    @timed('get_sub_pages')
+    def get_sub_pages(self, before=None, after=None):
+        # Resolve the specific pages, their thumbnails and the thumbnail renditions
+        # in bulk, the listing would otherwise run several queries per child.
+        sub_pages = keyset_paginate(
+            self.get_children().live(), self.sub_pages_per_page, before=before, after=after)
+        prefetch_thumbnails(sub_pages.object_list, responsive_filter_specs[self.sub_page_thumbnail_filter])
+        return sub_pages
+
+    def get_context(self, request, *args, **kwargs):
+        context = super(CategoryPage, self).get_context(request, *args, **kwargs)
+        context['sub_pages'] = self.get_sub_pages(
+            before=request.GET.get('before'), after=request.GET.get('after'))
+        return context
+
+    def serve(self, request, *args, **kwargs):
+        if request.GET.get('format') == 'json':
+            context = self.get_context(request, *args, **kwargs)
+            template = self.fragment_templates[self.get_template(request, *args, **kwargs)]
+            return JsonResponse({
+                'html': render_to_string(template, context, request=request),
+                'next_cursor': context['sub_pages'].next_cursor(),
+            })
+        return super(CategoryPage, self).serve(request, *args, **kwargs)
 
     class Meta:
         verbose_name = u'分类页面'
@@ -128,16 +250,41 @@ CategoryPage.content_panels = [
 
 class BaseDetailsPage(Page):
 
+    @timed('get_prev')
     def get_prev(self):
+        try:
+            return get_neighbor(self, -1)
+        except StaleSiblingIndex:
+            pass
+        if not self.first_published_at:
+            return None
         query = self.get_siblings().live().filter(first_published_at__lt=self.first_published_at)
         if query.exists():
             return query.order_by('-first_published_at')[0]
 
+    @timed('get_next')
     def get_next(self):
+        try:
+            return get_neighbor(self, 1)
+        except StaleSiblingIndex:
+            pass
+        if not self.first_published_at:
+            return None
         query = self.get_siblings().live().filter(first_published_at__gt=self.first_published_at)
         if query.exists():
             return query.order_by('first_published_at')[0]
 
+    def save(self, *args, **kwargs):
+        # Pages dated before they were published are listed by their date.
+        # Set before the one write, saving again would re-run the whole
+        # page save, its signals and the search indexing.
+        timestamp = getattr(self, 'timestamp', None)
+        if self.first_published_at and timestamp and self.first_published_at > timestamp:
+            self.first_published_at = timestamp
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = list(kwargs['update_fields']) + ['first_published_at']
+        return super(BaseDetailsPage, self).save(*args, **kwargs)
+
     class Meta:
         abstract = True
 
@@ -174,12 +321,6 @@ class SimplePage(BaseDetailsPage):
     api_fields = ['intro', 'body', 'thumbnail', ]
     subpage_types = []
 
-    def save(self, *args, **kwargs):
-        result = super(SimplePage, self).save(*args, **kwargs)
-        if self.first_published_at and self.timestamp and self.first_published_at > self.timestamp:
-            self.first_published_at = self.timestamp
-            self.save()
-
     class Meta:
         verbose_name = u'简单页面'
 
@@ -208,37 +349,77 @@ class GalleryPage(BaseDetailsPage):
         blank=True,
         null=True
     )
+    # The image of the first gallery image, set when the page is saved and
+    # when its gallery images or their images change, see sync_gallery_thumbnail
+    thumbnail = models.ForeignKey(
+        'wagtailimages.Image',
+        null=True,
+        blank=True,
+        editable=False,
+        on_delete=models.SET_NULL,
+        related_name='+'
+    )
 
     search_fields = Page.search_fields + [
         index.SearchField('title'),
         index.SearchField('intro'),
     ]
 
-    api_fields = ['intro', ]
+    api_fields = ['intro', 'thumbnail', 'gallery_images', ]
     subpage_types = []
 
-    @property
-    def thumbnail(self):
-        if self.id and self.gallery_images.all():
-            return self.gallery_images.all()[0].image
+    # The rendition the carousel shows for each gallery image, and the
+    # narrower and wider ones for phones and high density screens
+    carousel_filter = register_responsive_filter('width-750', [400, 1080])
+
+    def get_context(self, request, *args, **kwargs):
+        context = super(GalleryPage, self).get_context(request, *args, **kwargs)
+        gallery_images = list(self.gallery_images.select_related('image'))
+        prefetch_renditions(
+            [gallery_image.image for gallery_image in gallery_images],
+            responsive_filter_specs[self.carousel_filter])
+        context['gallery_images'] = gallery_images
+        return context
+
+    def get_thumbnail_timestamp(self):
+        """
+        Return when the thumbnail was taken according to its file name, like
+        IMG_2017-03-01-101010.jpg, or None.
+        """
+        if self.thumbnail:
+            filename = self.thumbnail.filename.lower()
+            if 'img_' in filename:
+                time_str = filename.replace('img_', '').replace('.jpg', '')
+                time_str = time_str[:17]
+                try:
+                    return datetime.strptime(time_str, '%Y-%m-%d-%H%M%S')
+                except ValueError:
+                    return None
 
     def save(self, *args, **kwargs):
-        result = super(GalleryPage, self).save(*args, **kwargs)
+        update_fields = kwargs.get('update_fields')
+        changed_fields = []
+        if update_fields is None or 'gallery_images' in update_fields:
+            # The first gallery image, from the ones about to be written along
+            # with the page when it's published or edited
+            thumbnail_id = next(
+                (gallery_image.image_id for gallery_image in self.gallery_images.all() if gallery_image.image_id),
+                None)
+            if self.thumbnail_id != thumbnail_id:
+                self.thumbnail_id = thumbnail_id
+                changed_fields.append('thumbnail')
         if not self.timestamp:
-            thumbnail = self.thumbnail
-            if thumbnail:
-                filename = thumbnail.filename.lower()
-                if 'img_' in filename:
-                    time_str = filename.replace('img_', '').replace('.jpg', '')
-                    time_str = time_str[:17]
-                    timestmap = datetime.strptime(time_str, '%Y-%m-%d-%H%M%S')
-                    self.timestamp = timestmap
-                    self.save()
-
-        if self.first_published_at and self.timestamp and self.first_published_at > self.timestamp:
-            self.first_published_at = self.timestamp
-            self.save()
-
+            self.timestamp = self.get_thumbnail_timestamp()
+            if self.timestamp:
+                changed_fields.append('timestamp')
+        if update_fields is not None and changed_fields:
+            kwargs['update_fields'] = list(update_fields) + changed_fields
+        # The gallery images written along don't need to sync the thumbnail
+        self._saving = True
+        try:
+            return super(GalleryPage, self).save(*args, **kwargs)
+        finally:
+            self._saving = False
 
     class Meta:
         verbose_name = u'图片页面'
@@ -252,37 +433,262 @@ GalleryPage.content_panels = [
 ]
 
 
-for orientation in ExifTags.TAGS.keys():
-    if ExifTags.TAGS[orientation] == 'Orientation': break
-
-
-def resize_image(path):
-    max_width = 1080
-    img = PILImage.open(path)
-    if hasattr(img, '_getexif'):
-        # we need to rotate the image based on exif info.
-        # https://stackoverflow.com/questions/4228530/pil-thumbnail-is-rotating-my-image
-        exif = img._getexif()
-        if not exif:
-            return
-        exif = dict(img._getexif().items())
-        if exif[orientation] == 3:
-            img = img.rotate(180, expand=True)
-        elif exif[orientation] == 6:
-            img = img.rotate(270, expand=True)
-        elif exif[orientation] == 8:
-            img = img.rotate(90, expand=True)
-    original_width, original_height = img.size
-    if original_width < max_width:  # no need to resize
-        return
-    width_percent = (max_width / float(original_width))
-    new_height = int((float(original_height) * float(width_percent)))
-    img = img.resize((max_width, new_height), PILImage.ANTIALIAS)
-    img.save(path)
+# Image jobs
+
+
+class ImageJobManager(models.Manager):
+
+    def enqueue(self, image, priority=0):
+        """
+        Queue a job for ``image``, or raise the priority of the one waiting.
+        """
+        pending = self.filter(image=image, status=ImageJob.STATUS_PENDING)
+        if not pending.exists():
+            return self.create(image=image, priority=priority)
+        pending.filter(priority__lt=priority).update(priority=priority)
+
+    def requeue_stale(self):
+        """
+        Put the jobs running for longer than ``IMAGE_JOB_TIMEOUT`` seconds,
+        left behind by a worker that died, back in the queue, or mark them
+        failed when they used up their attempts. Return how many there were.
+        """
+        timeout = getattr(settings, 'IMAGE_JOB_TIMEOUT', 60 * 10)
+        stale = self.filter(
+            status=ImageJob.STATUS_RUNNING, updated_at__lt=timezone.now() - timedelta(seconds=timeout))
+        failed = stale.filter(attempts__gte=ImageJob.max_attempts).update(
+            status=ImageJob.STATUS_FAILED, error='Worker stopped while running the job', updated_at=timezone.now())
+        requeued = stale.update(
+            status=ImageJob.STATUS_PENDING, run_after=timezone.now(), updated_at=timezone.now())
+        return failed + requeued
+
+    def claim_next(self):
+        """
+        Mark the due pending job with the highest priority, the oldest first,
+        as running and return it, or None if there is nothing to do. Safe to
+        call from several workers at once.
+        """
+        self.requeue_stale()
+        due = self.filter(status=ImageJob.STATUS_PENDING, run_after__lte=timezone.now())
+        for job_id in due.order_by('-priority', 'run_after', 'id').values_list('id', flat=True)[:10]:
+            claimed = self.filter(id=job_id, status=ImageJob.STATUS_PENDING).update(
+                status=ImageJob.STATUS_RUNNING,
+                attempts=F('attempts') + 1,
+                updated_at=timezone.now(),
+            )
+            if claimed:
+                return self.get(id=job_id)
+
+
+@python_2_unicode_compatible
+class ImageJob(models.Model):
+    """
+    Rotating, resizing and rendering an uploaded image, done by the
+    process_image_jobs worker instead of the upload request.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, u'等待'),
+        (STATUS_RUNNING, u'处理中'),
+        (STATUS_DONE, u'完成'),
+        (STATUS_FAILED, u'失败'),
+    )
+
+    max_attempts = 3
+    retry_delay = timedelta(minutes=1)
+    # The jobs of the images of a page being published go first
+    PRIORITY_PUBLISHED = 10
+
+    image = models.ForeignKey(
+        'wagtailimages.Image',
+        on_delete=models.CASCADE,
+        related_name='+'
+    )
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    attempts = models.PositiveIntegerField(default=0)
+    priority = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    run_after = models.DateTimeField(default=timezone.now)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = ImageJobManager()
+
+    def run(self):
+        try:
+            process_image(self.image)
+        except Exception:
+            self.error = traceback.format_exc()
+            if self.attempts < self.max_attempts:
+                self.status = self.STATUS_PENDING
+                self.run_after = timezone.now() + self.retry_delay * self.attempts
+            else:
+                self.status = self.STATUS_FAILED
+        else:
+            self.status = self.STATUS_DONE
+            self.error = ''
+        self.save()
+
+    def retry(self):
+        self.status = self.STATUS_PENDING
+        self.attempts = 0
+        self.run_after = timezone.now()
+        self.save()
+
+    def __str__(self):
+        return '%s #%s (%s)' % (self.image, self.image_id, self.get_status_display())
+
+    class Meta:
+        verbose_name = u'图片处理任务'
 
 
-def image_post_save(sender, instance, **kwargs):
-    image_path = instance.file.path
-    resize_image(image_path)
+def image_post_save(sender, instance, created, **kwargs):
+    ImageJob.objects.enqueue(instance)
+    if not created:
+        # The file may have been replaced and the renditions pages link to deleted
+        invalidate_site_cache()
 
 post_save.connect(image_post_save, sender=WagtailImage)
+
+
+def rendition_pre_delete(sender, instance, **kwargs):
+    # Before wagtailimages deletes the file and forgets its name
+    delete_variants(instance)
+
+pre_delete.connect(rendition_pre_delete, sender=WagtailImage.get_rendition_model())
+
+
+def page_published_renditions(sender, instance, **kwargs):
+    # Images uploaded before the filter specs they need were registered, or
+    # whose job hasn't run yet. Their renditions are made by the worker after
+    # the image is resized, ahead of the other jobs.
+    missing = get_missing_renditions(get_page_images(instance))
+    for image in set(image for image, filter_spec in missing):
+        ImageJob.objects.enqueue(image, priority=ImageJob.PRIORITY_PUBLISHED)
+
+page_published.connect(page_published_renditions)
+
+
+def page_pre_save(sender, instance, **kwargs):
+    if isinstance(instance, Page) and instance.id:
+        # Publishing a page that no longer shows in menus changes the menu too,
+        # and moved pages are only told apart by their new url_path.
+        instance._was_in_menu, instance._old_url_path = Page.objects.filter(
+            id=instance.id).values_list('show_in_menus', 'url_path').first() or (False, None)
+
+pre_save.connect(page_pre_save)
+
+
+# Connected before page_changed, so that the category is never rendered with
+# its old statistics under the new cache versions
+def update_parent_category_stats(sender, instance, **kwargs):
+    category = CategoryPage.objects.filter(path=get_parent_path(instance)).first()
+    if category is not None:
+        category.update_stats()
+
+page_published.connect(update_parent_category_stats)
+page_unpublished.connect(update_parent_category_stats)
+post_delete.connect(update_parent_category_stats, sender=Page)
+
+
+def page_changed(sender, instance, **kwargs):
+    invalidate_page_cache(instance)
+    invalidate_sibling_index(instance)
+
+page_published.connect(page_changed)
+page_unpublished.connect(page_changed)
+# Deleting a page deletes its Page row as well
+post_delete.connect(page_changed, sender=Page)
+
+
+def sync_gallery_thumbnail(page_id):
+    """
+    Set the thumbnail of the gallery page ``page_id`` to the image of its first
+    stored gallery image, and refresh what shows it when it changed.
+    """
+    thumbnail_id = GalleryPageGalleryImage.objects.filter(
+        page_id=page_id, image__isnull=False).values_list('image_id', flat=True).first()
+    page = GalleryPage.objects.filter(id=page_id).first()
+    if page is None or page.thumbnail_id == thumbnail_id:
+        return
+    GalleryPage.objects.filter(id=page_id).update(thumbnail_id=thumbnail_id)
+    page.thumbnail_id = thumbnail_id
+    if page.live:
+        update_parent_category_stats(GalleryPage, page)
+        invalidate_page_cache(page)
+
+
+# The gallery pages being deleted, along with their gallery images
+_deleted_gallery_page_ids = set()
+
+
+def gallery_image_changed(sender, instance, **kwargs):
+    # Gallery images deleted or reordered on their own, not by GalleryPage.save
+    # or along with their page
+    if kwargs.get('raw') or instance.page_id in _deleted_gallery_page_ids:
+        return
+    if GalleryPageGalleryImage.page.is_cached(instance) and getattr(instance.page, '_saving', False):
+        return
+    sync_gallery_thumbnail(instance.page_id)
+
+post_save.connect(gallery_image_changed, sender=GalleryPageGalleryImage)
+post_delete.connect(gallery_image_changed, sender=GalleryPageGalleryImage)
+
+
+def gallery_page_pre_delete(sender, instance, **kwargs):
+    _deleted_gallery_page_ids.add(instance.id)
+
+
+def gallery_page_post_delete(sender, instance, **kwargs):
+    _deleted_gallery_page_ids.discard(instance.id)
+
+pre_delete.connect(gallery_page_pre_delete, sender=GalleryPage)
+post_delete.connect(gallery_page_post_delete, sender=GalleryPage)
+
+
+def image_pre_delete(sender, instance, **kwargs):
+    # Deleting the image clears the gallery images and thumbnails showing it
+    # without sending signals
+    instance._gallery_page_ids = set(GalleryPageGalleryImage.objects.filter(
+        image=instance).values_list('page_id', flat=True))
+
+
+def image_post_delete(sender, instance, **kwargs):
+    for page_id in getattr(instance, '_gallery_page_ids', ()):
+        sync_gallery_thumbnail(page_id)
+
+pre_delete.connect(image_pre_delete, sender=WagtailImage)
+post_delete.connect(image_post_delete, sender=WagtailImage)
+
+
+def category_page_published(sender, instance, **kwargs):
+    # The statistics in the published revision may be out of date
+    instance.update_stats()
+
+page_published.connect(category_page_published, sender=CategoryPage)
+
+
+def page_moved(sender, instance, **kwargs):
+    # Page.move saves the moved page as a plain Page, treebeard saves the
+    # parent of deleted pages the same way.
+    old_url_path = getattr(instance, '_old_url_path', instance.url_path)
+    if old_url_path != instance.url_path:
+        invalidate_site_cache()
+        invalidate_sibling_index(instance)
+        # The page is already under its new parent, find the old one by url
+        old_parent_url_path = old_url_path.rstrip('/').rsplit('/', 1)[0] + '/'
+        for category in CategoryPage.objects.filter(
+                Q(path=get_parent_path(instance)) | Q(url_path=old_parent_url_path)):
+            category.update_stats()
+
+post_save.connect(page_moved, sender=Page)
+
+
+def view_restriction_changed(sender, instance, **kwargs):
+    invalidate_site_cache()
+
+post_save.connect(view_restriction_changed, sender=PageViewRestriction)
+post_delete.connect(view_restriction_changed, sender=PageViewRestriction)
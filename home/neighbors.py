@@ -0,0 +1,68 @@
+# -*- coding: UTF-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+
+from wagtail.wagtailcore.models import Page
+
+
+SIBLING_INDEX_KEY = 'home:sibling-index:%s'
+SIBLING_INDEX_TIMEOUT = 60 * 60 * 24 * 7
+
+
+class StaleSiblingIndex(Exception):
+    pass
+
+
+def get_parent_path(page):
+    return page.path[:-page.steplen]
+
+
+def get_sibling_index(page):
+    """
+    Return the ids of the live siblings of ``page`` (itself included) ordered
+    by ``first_published_at``, from the cache when possible.
+    """
+    key = SIBLING_INDEX_KEY % get_parent_path(page)
+    index = cache.get(key)
+    if index is None:
+        index = list(
+            page.get_siblings().live()
+            .order_by('first_published_at', 'id')
+            .values_list('id', flat=True)
+        )
+        cache.set(key, index, SIBLING_INDEX_TIMEOUT)
+    return index
+
+
+def invalidate_sibling_index(page):
+    cache.delete(SIBLING_INDEX_KEY % get_parent_path(page))
+
+
+def get_neighbor(page, offset):
+    """
+    Return the live sibling ``offset`` places away from ``page`` in publishing
+    order, or None when there is none. Raise ``StaleSiblingIndex`` when the
+    index no longer matches the tree, the caller should then query the
+    siblings directly.
+    """
+    index = get_sibling_index(page)
+    try:
+        position = index.index(page.id)
+    except ValueError:
+        # Drafts and previews are never in the index, don't throw it away for them
+        if page.live:
+            invalidate_sibling_index(page)
+        raise StaleSiblingIndex
+
+    position += offset
+    if position < 0 or position >= len(index):
+        return None
+
+    neighbor = Page.objects.live().filter(
+        id=index[position], depth=page.depth, path__startswith=get_parent_path(page),
+    ).first()
+    if neighbor is None:
+        invalidate_sibling_index(page)
+        raise StaleSiblingIndex
+    return neighbor
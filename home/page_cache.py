@@ -0,0 +1,265 @@
+# -*- coding: UTF-8 -*-
+"""
+Rendered HTML cache for the pages served to anonymous visitors.
+
+Responses are stored under their host and full path together with the id of
+the page that produced them and the cache versions current when they were
+rendered: one per page and one for the whole site. Bumping a version
+invalidates every cached response that depends on it, see
+``invalidate_page_cache``.
+
+The versions also make the ETag of the pages, and the time they were bumped
+their Last-Modified date, so that conditional requests are answered with a
+304 before the page is rendered, see ``get_conditional_page_response``.
+"""
+from __future__ import unicode_literals
+import atexit
+import hashlib
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from wagtail.wagtailcore.models import Page
+
+from home.neighbors import SIBLING_INDEX_KEY, get_parent_path
+
+
+RESPONSE_KEY = 'home:page-cache:%s'
+PAGE_VERSION_KEY = 'home:page-cache-version:%s'
+SITE_VERSION_KEY = 'home:page-cache-version'
+PAGES_VERSION_KEY = 'home:page-cache-version:pages'
+HITS_KEY = 'home:page-cache-hits'
+MISSES_KEY = 'home:page-cache-misses'
+
+# Hits and misses counted in this process and not added to the cache yet
+_counts_lock = threading.Lock()
+_pending_counts = Counter()
+_last_flush = time.time()
+
+
+def get_timeout():
+    return getattr(settings, 'PAGE_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def get_response_key(request):
+    url = '%s%s' % (request.get_host(), request.get_full_path())
+    return RESPONSE_KEY % hashlib.md5(url.encode('utf-8')).hexdigest()
+
+
+def new_version():
+    """
+    Return a new unique version, prefixed with the current time.
+    """
+    return '%d.%s' % (time.time(), uuid.uuid4().hex)
+
+
+def get_site_version():
+    """
+    Return the current site version, it changes whenever the menu or the
+    page tree structure changes.
+    """
+    version = cache.get(SITE_VERSION_KEY)
+    if version is None:
+        cache.add(SITE_VERSION_KEY, new_version(), None)
+        version = cache.get(SITE_VERSION_KEY)
+    return version
+
+
+def get_versions(page_id):
+    """
+    Return the current ``(site version, page version)`` for ``page_id``.
+    Missing versions get a fresh unique value, so that a version evicted
+    from the cache can never match the one of an older response.
+    """
+    return get_many_versions([SITE_VERSION_KEY, PAGE_VERSION_KEY % page_id])
+
+
+def get_listing_versions():
+    """
+    Return the current ``(site version, pages version)``, the pages version
+    changes whenever any page does. For the responses listing pages from
+    anywhere in the tree, see home.api.
+    """
+    return get_many_versions([SITE_VERSION_KEY, PAGES_VERSION_KEY])
+
+
+def get_many_versions(keys):
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, new_version(), None)
+            versions[key] = cache.get(key)
+    return tuple(versions[key] for key in keys)
+
+
+def get_etag(request, versions):
+    # The path is part of it, the same page has other representations
+    etag = '%s:%s:%s' % ((request.get_full_path(),) + tuple(versions))
+    return quote_etag(hashlib.md5(etag.encode('utf-8')).hexdigest())
+
+
+def get_last_modified(versions):
+    return max(int(version.split('.')[0]) for version in versions)
+
+
+def set_validators(request, response, versions):
+    response['ETag'] = get_etag(request, versions)
+    response['Last-Modified'] = http_date(get_last_modified(versions))
+
+
+def get_conditional_page_response(request, page_id):
+    """
+    Return a 304 response if the client already has the current version of
+    the page ``page_id``, None otherwise. The versions are kept on the request
+    for the response, see ``cache_response``.
+    """
+    request.page_cache_versions = versions = get_versions(page_id)
+    response = get_conditional_response(
+        request, etag=get_etag(request, versions), last_modified=get_last_modified(versions))
+    if response is not None:
+        set_validators(request, response, versions)
+    return response
+
+
+def get_stats_flush_interval():
+    return getattr(settings, 'PAGE_CACHE_STATS_FLUSH_INTERVAL', 10)
+
+
+def counts_enabled():
+    # The file based cache rewrites a file and scans its directory on every
+    # write, and its incr isn't atomic: counting would cost more than it tells
+    return not isinstance(caches['default'], FileBasedCache)
+
+
+def count(key):
+    """
+    Count a hit or a miss in memory, and add the counts of the process to the
+    ones in the cache every ``PAGE_CACHE_STATS_FLUSH_INTERVAL`` seconds.
+    """
+    global _last_flush
+    if not counts_enabled():
+        return
+    with _counts_lock:
+        _pending_counts[key] += 1
+        if time.time() - _last_flush < get_stats_flush_interval():
+            return
+        _last_flush = time.time()
+    flush_counts()
+
+
+@atexit.register
+def flush_counts():
+    with _counts_lock:
+        pending_counts = _pending_counts.copy()
+        _pending_counts.clear()
+    for key, value in pending_counts.items():
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, value)
+        except ValueError:  # evicted in between
+            pass
+
+
+def get_stats():
+    stats = cache.get_many([HITS_KEY, MISSES_KEY])
+    return stats.get(HITS_KEY, 0), stats.get(MISSES_KEY, 0)
+
+
+def reset_stats():
+    cache.delete_many([HITS_KEY, MISSES_KEY])
+
+
+def get_cached_response(request):
+    cached = cache.get(get_response_key(request))
+    if cached is not None:
+        versions = get_versions(cached['page_id'])
+        if tuple(cached['versions']) == versions:
+            count(HITS_KEY)
+            response = HttpResponse(cached['content'], content_type=cached['content_type'])
+            response['X-Page-Cache'] = 'HIT'
+            set_validators(request, response, versions)
+            return get_conditional_response(
+                request, etag=response['ETag'], last_modified=get_last_modified(versions), response=response)
+
+
+def cache_response(request, page_id, response):
+    # The versions read before the page was rendered, a change made while it
+    # was rendering must invalidate it
+    versions = getattr(request, 'page_cache_versions', None) or get_versions(page_id)
+    cache.set(get_response_key(request), {
+        'page_id': page_id,
+        'versions': versions,
+        'content': response.content,
+        'content_type': response['Content-Type'],
+    }, get_timeout())
+    # Only the responses that can be cached count as misses
+    count(MISSES_KEY)
+    response['X-Page-Cache'] = 'MISS'
+    set_validators(request, response, versions)
+
+
+def get_neighbor_ids(page):
+    """
+    Return the ids of the live siblings right before and after ``page`` in
+    publishing order, both in the sibling index as it was cached before the
+    change and in the database now.
+    """
+    ids = set()
+    index = cache.get(SIBLING_INDEX_KEY % get_parent_path(page))
+    if index and page.id in index:
+        position = index.index(page.id)
+        ids.update(index[max(position - 1, 0):position + 2])
+
+    if page.first_published_at:
+        siblings = page.get_siblings().live().exclude(id=page.id).values_list('id', flat=True)
+        ids.update(siblings.filter(first_published_at__lte=page.first_published_at)
+                   .order_by('-first_published_at', '-id')[:1])
+        ids.update(siblings.filter(first_published_at__gte=page.first_published_at)
+                   .order_by('first_published_at', 'id')[:1])
+    ids.discard(page.id)
+    return ids
+
+
+def affects_menu(page):
+    # The menu lists the categories and the pages under them shown in menus
+    # and the home page lists the categories, see pages_tags.top_menu.
+    return page.depth <= 3 or page.show_in_menus or getattr(page, '_was_in_menu', False)
+
+
+def invalidate_site_cache():
+    cache.set(SITE_VERSION_KEY, new_version(), None)
+
+
+def invalidate_page_cache(page):
+    """
+    Invalidate the cached responses that show ``page``: its own, its parent's
+    listing and its neighbours' previous/next links, or every page when it is
+    part of the menu.
+    """
+    if affects_menu(page):
+        invalidate_site_cache()
+        return
+
+    page_ids = get_neighbor_ids(page)
+    page_ids.add(page.id)
+    page_ids.update(Page.objects.filter(path=get_parent_path(page)).values_list('id', flat=True))
+    invalidate_page_versions(page_ids)
+
+
+def invalidate_page_versions(page_ids):
+    """
+    Invalidate the cached responses of the pages ``page_ids`` and the
+    listings of pages.
+    """
+    version = new_version()
+    versions = dict((PAGE_VERSION_KEY % page_id, version) for page_id in page_ids)
+    versions[PAGES_VERSION_KEY] = version
+    cache.set_many(versions, None)
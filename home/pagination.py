@@ -0,0 +1,98 @@
+# -*- coding: UTF-8 -*-
+from __future__ import unicode_literals
+from datetime import datetime
+
+from django.db.models import Q
+
+
+CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(page):
+    return '%s.%d' % (page.first_published_at.strftime(CURSOR_DATE_FORMAT), page.id)
+
+
+def decode_cursor(cursor):
+    """
+    Return the ``(first_published_at, id)`` pair encoded in ``cursor``, or None
+    if it isn't a valid cursor.
+    """
+    try:
+        date_str, pk = cursor.split('.')
+        return datetime.strptime(date_str, CURSOR_DATE_FORMAT), int(pk)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPage(object):
+    """
+    A window of pages ordered from newest to oldest, addressed by the position
+    of its first or last page instead of an offset, so that fetching any window
+    costs the same indexed range query however deep it is.
+    """
+
+    def __init__(self, object_list, has_previous, has_next):
+        self.object_list = object_list
+        self._has_previous = has_previous
+        self._has_next = has_next
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self._has_previous and bool(self.object_list)
+
+    def has_next(self):
+        return self._has_next and bool(self.object_list)
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_cursor(self):
+        if self.has_previous():
+            return encode_cursor(self.object_list[0])
+
+    def next_cursor(self):
+        if self.has_next():
+            return encode_cursor(self.object_list[-1])
+
+
+def keyset_paginate(queryset, per_page, before=None, after=None):
+    """
+    Return the ``KeysetPage`` of ``queryset`` (ordered by ``-first_published_at``,
+    ``-id``) holding the ``per_page`` pages right before the ``before`` cursor,
+    right after the ``after`` cursor, or the first ones when neither is given.
+    Invalid cursors are ignored.
+    """
+    # Pages created without being published, like the initial home page, or
+    # imported without a date have no place in the order
+    queryset = queryset.filter(first_published_at__isnull=False)
+    before = decode_cursor(before) if before else None
+    after = decode_cursor(after) if after else None
+
+    if before:
+        published_at, pk = before
+        object_list = list(queryset.filter(
+            Q(first_published_at__gt=published_at) |
+            Q(first_published_at=published_at, id__gt=pk)
+        ).order_by('first_published_at', 'id')[:per_page + 1].specific())
+        if object_list:
+            has_previous = len(object_list) > per_page
+            object_list = object_list[:per_page][::-1]
+            return KeysetPage(object_list, has_previous=has_previous, has_next=True)
+        # Nothing newer than the cursor any more, start over from the first window
+        after = None
+
+    if after:
+        published_at, pk = after
+        queryset = queryset.filter(
+            Q(first_published_at__lt=published_at) |
+            Q(first_published_at=published_at, id__lt=pk)
+        )
+    queryset = queryset.order_by('-first_published_at', '-id')
+    object_list = list(queryset[:per_page + 1].specific())
+    has_next = len(object_list) > per_page
+    return KeysetPage(object_list[:per_page], has_previous=bool(after), has_next=has_next)
@@ -0,0 +1,85 @@
+# -*- coding: UTF-8 -*-
+"""
+Static file storages that also write gzip and brotli compressed copies of
+the text files they store, ``<name>.gz`` and ``<name>.br``, for the web
+server to send as they are instead of compressing every response (nginx
+``gzip_static`` and ``brotli_static``). The brotli copies need the Brotli
+package.
+"""
+from __future__ import absolute_import, unicode_literals
+import gzip
+import io
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+from compressor.storage import CompressorFileStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Fonts like woff and the images are compressed already
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg', '.eot', '.ttf')
+
+
+def gzip_compress(content):
+    f = io.BytesIO()
+    # No timestamp in the header, the same file always compresses the same
+    with gzip.GzipFile(fileobj=f, mode='wb', compresslevel=9, mtime=0) as gz:
+        gz.write(content)
+    return f.getvalue()
+
+
+def write_precompressed(path):
+    """
+    Write the compressed copies of the file at ``path`` next to it, the ones
+    that are smaller than the file.
+    """
+    if not path.endswith(COMPRESSIBLE_EXTENSIONS):
+        return
+    with open(path, 'rb') as f:
+        content = f.read()
+    copies = [('.gz', gzip_compress(content))]
+    if brotli is not None:
+        copies.append(('.br', brotli.compress(content)))
+
+    stat = os.stat(path)
+    for extension, compressed in copies:
+        if len(compressed) < len(content):
+            with open(path + extension, 'wb') as f:
+                f.write(compressed)
+            # gzip_static compares the times of the copy and the file
+            os.utime(path + extension, (stat.st_atime, stat.st_mtime))
+
+
+class PrecompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """
+    Collects the static files under names with a hash of their content, which
+    can be cached forever, and compresses them.
+    """
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super(PrecompressedManifestStaticFilesStorage, self).post_process(
+                paths, dry_run=dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+
+        if not dry_run:
+            for hashed_name in hashed_names:
+                write_precompressed(self.path(hashed_name))
+
+
+class PrecompressedCompressorFileStorage(CompressorFileStorage):
+    """
+    Stores and compresses the bundles django-compressor makes, named after a
+    hash of their content as well.
+    """
+
+    def save(self, filename, content):
+        filename = super(PrecompressedCompressorFileStorage, self).save(filename, content)
+        write_precompressed(self.path(filename))
+        return filename
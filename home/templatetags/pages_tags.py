@@ -1,11 +1,19 @@
 from datetime import date
 from django import template
 from django.conf import settings
+from django.core.cache import cache
+from django.utils.html import format_html, format_html_join
 
+from home.images import get_rendition, get_responsive_renditions, get_variant_name, has_variants, modern_formats
+from home.instrumentation import timed
 from home.models import Page
+from home.page_cache import get_site_version
 
 register = template.Library()
 
+MENU_KEY = 'home:menu:%s:%s:%s'
+MENU_TIMEOUT = 60 * 60 * 24
+
 
 @register.assignment_tag(takes_context=True)
 def get_site_root(context):
@@ -14,23 +22,93 @@ def get_site_root(context):
     return context['request'].site.root_page
 
 
-def has_menu_children(page):
-    return page.get_children().live().in_menu().exists()
+# Same as `{% image image filter_spec as var %}`, but reuses the renditions
+# prefetched by home.images.prefetch_renditions
+@register.simple_tag
+def rendition(image, filter_spec):
+    return get_rendition(image, filter_spec)
+
+
+def get_srcset(renditions, url):
+    return ', '.join('%s %dw' % (url(rendition), rendition.width) for rendition in renditions)
+
+
+# Renders ``image`` at the widths registered for ``filter_spec`` with
+# home.images.register_responsive_filter, as an <img> with a srcset, and the
+# same widths in the modern formats they have been converted to already as
+# <source>s of a <picture>. The conversions are made by
+# home.images.generate_renditions, never while rendering. ``sizes`` is how
+# wide the image is shown, see the sizes attribute of <img>.
+@register.simple_tag
+def responsive_image(image, filter_spec, sizes, loading='lazy'):
+    if not image:
+        return ''
+    with timed('responsive_image'):
+        fallback = get_rendition(image, filter_spec)
+        renditions = get_responsive_renditions(image, filter_spec)
+        img = format_html(
+            '<img src="{}" srcset="{}" sizes="{}" width="{}" height="{}" alt="{}" '
+            'loading="{}" class="img-responsive">',
+            fallback.url, get_srcset(renditions, lambda rendition: rendition.url), sizes,
+            fallback.width, fallback.height, fallback.alt, loading)
+        if not modern_formats or not all(rendition.pk for rendition in renditions):
+            return img
+
+        sources = format_html_join('', '<source type="{}" srcset="{}" sizes="{}">', (
+            (mime_type, get_srcset(
+                renditions, lambda rendition: rendition.file.storage.url(get_variant_name(rendition, fmt))), sizes)
+            for fmt, mime_type in modern_formats
+            if has_variants(renditions, fmt)
+        ))
+        if not sources:
+            return img
+        return format_html('<picture>{}{}</picture>', sources, img)
+
+
+def get_menu(parent, site):
+    """
+    Return the live pages shown in menus under ``parent`` and their own such
+    children, as nested dicts loaded with a single query and cached until the
+    menu or the page tree changes.
+    """
+    key = MENU_KEY % (parent.id, site.id, get_site_version())
+    menuitems = cache.get(key)
+    if menuitems is None:
+        pages = Page.objects.live().in_menu().filter(
+            path__startswith=parent.path,
+            depth__in=[parent.depth + 1, parent.depth + 2],
+        ).order_by('path')
+        menuitems = []
+        items_by_path = {}
+        for page in pages:
+            item = {
+                'title': page.title,
+                'url': page.relative_url(site),
+                'path': page.path,
+                'children': [],
+            }
+            if page.depth == parent.depth + 1:
+                menuitems.append(item)
+                items_by_path[page.path] = item
+            elif page.path[:-page.steplen] in items_by_path:
+                items_by_path[page.path[:-page.steplen]]['children'].append(item)
+        cache.set(key, menuitems, MENU_TIMEOUT)
+    return menuitems
 
 
 # Retrieves the top menu items - the immediate children of the parent page
-# The has_menu_children method is necessary because the bootstrap menu requires
-# a dropdown class to be applied to a parent
+# The children are needed because the bootstrap menu requires a dropdown
+# class to be applied to a parent
 @register.inclusion_tag('pages/tags/top_menu.html', takes_context=True)
 def top_menu(context, parent, calling_page=None):
-    menuitems = parent.get_children().live().in_menu()
-    for menuitem in menuitems:
-        menuitem.show_dropdown = has_menu_children(menuitem)
-        # We don't directly check if calling_page is None since the template
-        # engine can pass an empty string to calling_page
-        # if the variable passed as calling_page does not exist.
-        menuitem.active = (calling_page.path.startswith(menuitem.path)
-                           if calling_page else False)
+    # We don't directly check if calling_page is None since the template
+    # engine can pass an empty string to calling_page
+    # if the variable passed as calling_page does not exist.
+    active_path = calling_page.path[:Page.steplen * (parent.depth + 1)] if calling_page else None
+    menuitems = [
+        dict(menuitem, active=menuitem['path'] == active_path)
+        for menuitem in get_menu(parent, context['request'].site)
+    ]
     return {
         'calling_page': calling_page,
         'menuitems': menuitems,
@@ -42,8 +120,7 @@ def top_menu(context, parent, calling_page=None):
 # Retrieves the children of the top menu items for the drop downs
 @register.inclusion_tag('pages/tags/top_menu_children.html', takes_context=True)
 def top_menu_children(context, parent):
-    menuitems_children = parent.get_children()
-    menuitems_children = menuitems_children.live().in_menu()
+    menuitems_children = parent['children']
     return {
         'parent': parent,
         'menuitems_children': menuitems_children,
@@ -52,3 +129,19 @@ def top_menu_children(context, parent):
     }
 
 
+def time_rendering(name):
+    """
+    Time the rendering of the tag ``name``, its template included, under its
+    name. Inclusion tags can't be wrapped in ``timed`` as they are declared,
+    their arguments are read from the function.
+    """
+    compile_function = register.tags[name]
+
+    def compile_timed(parser, token):
+        node = compile_function(parser, token)
+        node.render = timed(name)(node.render)
+        return node
+    register.tags[name] = compile_timed
+
+time_rendering('top_menu')
+time_rendering('top_menu_children')
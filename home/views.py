@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""
+Serving of the original images and their renditions under MEDIA_ROOT.
+
+The files keep their names when they change: the image jobs rewrite the
+originals in place and renditions are made again under the same names. So
+they are only cached for ``MEDIA_CACHE_MAX_AGE`` seconds, then revalidated
+with an ETag made of their modification time and size, which the unchanged
+files answer with a 304. Renditions missing from the disk, like on a server
+the originals were copied to without them, are made again from their
+original on the first request.
+
+Range requests get a 206 with the requested bytes. With ``MEDIA_SENDFILE``
+set to 'x-sendfile' (Apache mod_xsendfile, lighttpd) or 'x-accel-redirect'
+(nginx, see ``MEDIA_ACCEL_REDIRECT_PREFIX``) the web server sends the file
+and handles the ranges itself. Otherwise whole files are handed to the WSGI
+server's ``wsgi.file_wrapper``, which sends them with ``sendfile`` without
+copying them through Python when the server supports it, like gunicorn and
+uWSGI do.
+"""
+from __future__ import absolute_import, unicode_literals
+import io
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.base import ContentFile
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from django.utils.six.moves.urllib.parse import quote
+
+from wagtail.wagtailimages.models import Filter, Image as WagtailImage
+
+from home.images import MODERN_FORMATS, make_variant, modern_formats
+
+# The directories of MEDIA_ROOT served, the documents are served by
+# wagtaildocs which checks their privacy
+MEDIA_DIRECTORIES = ('original_images/', 'images/')
+MEDIA_CACHE_MAX_AGE = 60 * 60
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+CHUNK_SIZE = 64 * 1024
+
+CONTENT_TYPES = dict(('.%s' % fmt, mime_type) for fmt, mime_type in MODERN_FORMATS)
+
+
+def get_content_type(name):
+    extension = os.path.splitext(name)[1].lower()
+    return CONTENT_TYPES.get(extension) or mimetypes.guess_type(name)[0] or 'application/octet-stream'
+
+
+def restore_rendition(name):
+    """
+    Make the rendition or the converted rendition (see
+    ``home.images.make_variant``) stored as ``name`` again from its original.
+    Return whether there is such a rendition.
+    """
+    Rendition = WagtailImage.get_rendition_model()
+    base, extension = os.path.splitext(name)
+    if extension[1:] in dict(modern_formats):
+        names = [base + '.jpg', base + '.png', base + '.gif']
+    else:
+        names = [name]
+    rendition = Rendition.objects.filter(file__in=names).select_related('image').first()
+    if rendition is None:
+        return False
+
+    storage = rendition.file.storage
+    if not storage.exists(rendition.file.name):
+        output = io.BytesIO()
+        try:
+            Filter(spec=rendition.filter_spec).run(rendition.image, output)
+        except IOError:  # the original is missing too
+            return False
+        storage.save(rendition.file.name, ContentFile(output.getvalue()))
+    if rendition.file.name != name:
+        make_variant(rendition, extension[1:])
+    return True
+
+
+def get_media_path(name):
+    if not name.startswith(MEDIA_DIRECTORIES):
+        raise Http404
+    try:
+        path = safe_join(settings.MEDIA_ROOT, name)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(path):
+        if not name.startswith('images/') or not restore_rendition(name) or not os.path.isfile(path):
+            raise Http404
+    return path
+
+
+def parse_range(header, size):
+    """
+    Return the ``(first, last)`` byte positions asked for by the Range
+    ``header``, or None to send the whole file: without a header, or with
+    several or malformed ranges. Raise ValueError when the range starts past
+    the end of the file.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if not first:
+        # The last bytes of the file
+        length = int(last)
+        if not length:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size:
+        raise ValueError('Range past the end of the file')
+    if last < first:
+        return None
+    return first, last
+
+
+def iter_range(f, first, last):
+    try:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def get_file_response(request, name, path, size, etag, last_modified):
+    content_type = get_content_type(name)
+    sendfile = getattr(settings, 'MEDIA_SENDFILE', None)
+    if sendfile == 'x-sendfile':
+        response = HttpResponse(content_type=content_type)
+        response['X-Sendfile'] = path
+        return response
+    if sendfile == 'x-accel-redirect':
+        response = HttpResponse(content_type=content_type)
+        prefix = getattr(settings, 'MEDIA_ACCEL_REDIRECT_PREFIX', '/protected-media/')
+        response['X-Accel-Redirect'] = prefix + quote(name.encode('utf-8'))
+        return response
+
+    # Ranges only apply to the version of the file the client has
+    if_range = request.META.get('HTTP_IF_RANGE')
+    byte_range = None
+    if 'HTTP_RANGE' in request.META and (not if_range or if_range in (etag, http_date(last_modified))):
+        try:
+            byte_range = parse_range(request.META['HTTP_RANGE'], size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = 'bytes */%d' % size
+            return response
+
+    first, last = byte_range or (0, size - 1)
+    if request.method == 'HEAD':
+        response = HttpResponse(content_type=content_type)
+    elif byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    else:
+        response = StreamingHttpResponse(iter_range(open(path, 'rb'), first, last), content_type=content_type)
+    if byte_range is not None:
+        response.status_code = 206
+        response['Content-Range'] = 'bytes %d-%d/%d' % (first, last, size)
+    response['Content-Length'] = last - first + 1
+    return response
+
+
+def serve_media(request, path):
+    if request.method not in ('GET', 'HEAD'):
+        return HttpResponseNotAllowed(['GET', 'HEAD'])
+
+    full_path = get_media_path(path)
+    stat = os.stat(full_path)
+    last_modified = int(stat.st_mtime)
+    etag = quote_etag('%x-%x' % (last_modified, stat.st_size))
+
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = get_file_response(request, path, full_path, stat.st_size, etag, last_modified)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Accept-Ranges'] = 'bytes'
+    response['Cache-Control'] = 'public, max-age=%d' % getattr(
+        settings, 'MEDIA_CACHE_MAX_AGE', MEDIA_CACHE_MAX_AGE)
+    return response
@@ -0,0 +1,16 @@
+from __future__ import absolute_import, unicode_literals
+
+from wagtail.wagtailcore import hooks
+
+from home.page_cache import get_conditional_page_response
+
+
+@hooks.register('before_serve_page')
+def mark_page_cacheable(page, request, serve_args, serve_kwargs):
+    # Let PageCacheMiddleware keep the rendered page, unless who may see it is restricted
+    if not page.get_view_restrictions().exists():
+        request.page_cache_page_id = page.id
+        # Answer conditional requests before rendering anything, the page is
+        # the same for every anonymous visitor
+        if request.method in ('GET', 'HEAD') and not request.user.is_authenticated:
+            return get_conditional_page_response(request, page.id)
@@ -55,6 +55,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'home.middleware.InstrumentationMiddleware',
+
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -66,6 +68,8 @@ MIDDLEWARE = [
 
     'wagtail.wagtailcore.middleware.SiteMiddleware',
     'wagtail.wagtailredirects.middleware.RedirectMiddleware',
+
+    'home.middleware.PageCacheMiddleware',
 ]
 
 ROOT_URLCONF = 'little_tree.urls'
@@ -102,6 +106,62 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.11/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'OPTIONS': {
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+# How long the rendered pages are kept, publishing invalidates them anyway
+PAGE_CACHE_TIMEOUT = 60 * 60 * 24
+
+# The page cache hits and misses are counted in memory and added to the cache
+# every so many seconds, not with the file based cache
+PAGE_CACHE_STATS_FLUSH_INTERVAL = 10
+
+# Seconds after which an image job still marked running is taken to belong to
+# a worker that died, and queued again, see ImageJobManager.requeue_stale
+IMAGE_JOB_TIMEOUT = 60 * 10
+
+# Share of the requests timed by home.middleware.InstrumentationMiddleware
+INSTRUMENTATION_SAMPLE_RATE = 0
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'home.instrumentation': {
+            'handlers': ['console'],
+            'level': 'INFO',
+            'propagate': False,
+        },
+    },
+}
+
+# How long search results are kept, publishing invalidates them anyway
+SEARCH_CACHE_TIMEOUT = 60 * 5
+
+# Search results are counted up to this many, None to not count them
+SEARCH_COUNT_LIMIT = 1000
+
+# Full-text index of the live pages, see search.index
+SEARCH_INDEX_PATH = os.path.join(BASE_DIR, 'search_index.sqlite3')
+
+# Search hits are counted in memory and written every so many seconds
+SEARCH_HIT_FLUSH_INTERVAL = 10
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.11/topics/i18n/
 
@@ -123,6 +183,7 @@ USE_TZ = False
 STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.FileSystemFinder',
     'django.contrib.staticfiles.finders.AppDirectoriesFinder',
+    'compressor.finders.CompressorFinder',
 ]
 
 STATICFILES_DIRS = [
@@ -132,9 +193,28 @@ STATICFILES_DIRS = [
 STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 STATIC_URL = '/static/'
 
+# The {% compress %} blocks of the templates are concatenated and minified
+# into one file each, named after a hash of their content
+COMPRESS_CSS_FILTERS = [
+    'compressor.filters.css_default.CssAbsoluteFilter',
+    'compressor.filters.cssmin.rCSSMinFilter',
+]
+COMPRESS_JS_FILTERS = [
+    'compressor.filters.jsmin.JSMinFilter',
+]
+
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 MEDIA_URL = '/media/'
 
+# Images and renditions are served by home.views.serve_media, cached by the
+# browsers for so many seconds before they revalidate them, they can change
+# under the same name. Set MEDIA_SENDFILE to 'x-sendfile' or
+# 'x-accel-redirect' to have the web server send the files.
+MEDIA_CACHE_MAX_AGE = 60 * 60
+MEDIA_SENDFILE = None
+# The internal nginx location the media files are sent from with X-Accel-Redirect
+MEDIA_ACCEL_REDIRECT_PREFIX = '/protected-media/'
+
 
 # Wagtail settings
 
@@ -11,6 +11,8 @@ SECRET_KEY = '7ur19-i_6ekty4km!kp&8@1obi#$1&l9h(jv866z7gj$icjd04'
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 
+INSTRUMENTATION_SAMPLE_RATE = 1
+
 
 try:
     from .local import *
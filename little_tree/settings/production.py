@@ -4,6 +4,73 @@ from .base import *
 
 DEBUG = False
 
+INSTRUMENTATION_SAMPLE_RATE = 0.01
+
+# Let the web server in front send the media files, see home.views
+MEDIA_SENDFILE = os.environ.get('MEDIA_SENDFILE') or None
+
+# The static files and the {% compress %} bundles are built ahead of time,
+# with a hash of their content in their name and compressed copies next to
+# them, see home.storage and the README
+STATICFILES_STORAGE = 'home.storage.PrecompressedManifestStaticFilesStorage'
+COMPRESS_STORAGE = 'home.storage.PrecompressedCompressorFileStorage'
+COMPRESS_OFFLINE = True
+
+# Keep the database connections open between requests
+if os.environ.get('MYSQL_DATABASE'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.mysql',
+            'NAME': os.environ['MYSQL_DATABASE'],
+            'USER': os.environ.get('MYSQL_USER', ''),
+            'PASSWORD': os.environ.get('MYSQL_PASSWORD', ''),
+            'HOST': os.environ.get('MYSQL_HOST', ''),
+            'PORT': os.environ.get('MYSQL_PORT', ''),
+            'CONN_MAX_AGE': 60 * 10,
+            'OPTIONS': {
+                'charset': 'utf8mb4',
+                'init_command': "SET sql_mode='STRICT_TRANS_TABLES'",
+            },
+        }
+    }
+else:
+    DATABASES['default'].update({
+        'CONN_MAX_AGE': 60 * 10,
+        'OPTIONS': {
+            # Seconds a write waits for the lock held by another process
+            'timeout': 20,
+        },
+    })
+
+# Readers no longer block the writer and the other way round, see
+# home.db.configure_sqlite
+SQLITE_PRAGMAS = [
+    ('journal_mode', 'WAL'),
+    ('synchronous', 'NORMAL'),
+]
+
+# The page cache and its invalidation have to be shared by the worker processes
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django_redis.cache.RedisCache',
+            'LOCATION': os.environ['REDIS_URL'],
+            'OPTIONS': {
+                'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+            },
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': os.path.join(BASE_DIR, 'cache'),
+            'OPTIONS': {
+                'MAX_ENTRIES': 10000,
+            },
+        }
+    }
+
 try:
     from .local import *
 except ImportError:
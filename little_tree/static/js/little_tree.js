@@ -1,4 +1,67 @@
 $().ready(function(){
     // the body of this function is in assets/material-kit.js
     window_width = $(window).width();
-});
\ No newline at end of file
+});
+// Infinite scroll for the category pages: fetch the older sub pages as a
+// JSON fragment when the reader gets close to the pager.
+$().ready(function(){
+    var $pager = $('.sub-pages-pager');
+    var $next = $pager.find('.next a');
+    if (!$next.length) {
+        return;
+    }
+    var loading = false;
+
+    function loadMore() {
+        if (loading || !$next.data('cursor')) {
+            return;
+        }
+        loading = true;
+        $.getJSON(window.location.pathname, {after: $next.data('cursor'), format: 'json'}, function(data) {
+            $('.sub-pages').append(data.html);
+            if (data.next_cursor) {
+                $next.data('cursor', data.next_cursor).attr('href', '?after=' + data.next_cursor);
+            } else {
+                $next.parent().remove();
+                $next = $();
+            }
+        }).always(function() {
+            loading = false;
+        });
+    }
+
+    $(window).on('scroll', function() {
+        if ($next.length && $(window).scrollTop() + $(window).height() > $pager.offset().top - 300) {
+            loadMore();
+        }
+    });
+});
+// Title suggestions for the search box, picking one opens the page.
+$().ready(function(){
+    var $input = $('input[data-suggest-url]');
+    if (!$input.length) {
+        return;
+    }
+    var $list = $('#' + $input.attr('list'));
+    var urls = {};
+    var timer;
+
+    $input.on('input', function() {
+        var query = $input.val();
+        if (urls[query]) {
+            window.location = urls[query];
+            return;
+        }
+        clearTimeout(timer);
+        timer = setTimeout(function() {
+            $.getJSON($input.data('suggest-url'), {query: query}, function(data) {
+                urls = {};
+                $list.empty();
+                $.each(data.suggestions, function(i, suggestion) {
+                    urls[suggestion.title] = suggestion.url;
+                    $list.append($('<option>').attr('value', suggestion.title));
+                });
+            });
+        }, 150);
+    });
+});
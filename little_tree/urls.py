@@ -1,4 +1,5 @@
 from __future__ import absolute_import, unicode_literals
+import re
 
 from django.conf import settings
 from django.conf.urls import include, url
@@ -8,6 +9,8 @@ from wagtail.wagtailadmin import urls as wagtailadmin_urls
 from wagtail.wagtailcore import urls as wagtail_urls
 from wagtail.wagtaildocs import urls as wagtaildocs_urls
 
+from home import api as home_api
+from home import views as home_views
 from search import views as search_views
 
 urlpatterns = [
@@ -16,7 +19,13 @@ urlpatterns = [
     url(r'^admin/', include(wagtailadmin_urls)),
     url(r'^documents/', include(wagtaildocs_urls)),
 
+    url(r'^api/pages/$', home_api.page_list, name='api_page_list'),
+    url(r'^api/pages/(?P<page_id>\d+)/$', home_api.page_detail, name='api_page_detail'),
+
     url(r'^search/$', search_views.search, name='search'),
+    url(r'^search/suggest/$', search_views.suggest, name='search_suggest'),
+
+    url(r'^%s(?P<path>.+)$' % re.escape(settings.MEDIA_URL.lstrip('/')), home_views.serve_media, name='media'),
 
     # For anything not caught by a more specific rule above, hand over to
     # Wagtail's page serving mechanism. This should be the last pattern in
@@ -30,9 +39,7 @@ urlpatterns = [
 
 
 if settings.DEBUG:
-    from django.conf.urls.static import static
     from django.contrib.staticfiles.urls import staticfiles_urlpatterns
 
-    # Serve static and media files from development server
+    # Serve static files from development server
     urlpatterns += staticfiles_urlpatterns()
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
@@ -0,0 +1,87 @@
+"""
+Buffered search hit recording.
+
+``Query.add_hit`` writes to the database on every search, which on sqlite
+serialises every searching visitor behind the write lock. Hits are counted in
+memory instead and written in one transaction every
+``SEARCH_HIT_FLUSH_INTERVAL`` seconds by a background thread of the process.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import atexit
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from wagtail.wagtailsearch.models import Query, QueryDailyHits
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_pending_hits = Counter()
+_flush_thread = None
+
+
+def get_flush_interval():
+    return getattr(settings, 'SEARCH_HIT_FLUSH_INTERVAL', 10)
+
+
+def record_hit(query_string):
+    global _flush_thread
+    with _lock:
+        _pending_hits[query_string] += 1
+        if _flush_thread is None:
+            _flush_thread = threading.Thread(target=flush_periodically, name='search-hit-flush')
+            _flush_thread.daemon = True
+            _flush_thread.start()
+
+
+def flush_hits():
+    """
+    Write the buffered hits to the database, return how many were written.
+    """
+    with _lock:
+        pending_hits = _pending_hits.copy()
+        _pending_hits.clear()
+    if not pending_hits:
+        return 0
+
+    today = timezone.now().date()
+    try:
+        with transaction.atomic():
+            for query_string, hits in pending_hits.items():
+                query = Query.get(query_string)
+                daily_hits, created = QueryDailyHits.objects.get_or_create(query=query, date=today)
+                QueryDailyHits.objects.filter(id=daily_hits.id).update(hits=F('hits') + hits)
+    except Exception:
+        # Keep the hits for the next flush rather than losing them
+        with _lock:
+            _pending_hits.update(pending_hits)
+        raise
+    return sum(pending_hits.values())
+
+
+def flush_periodically():
+    while True:
+        time.sleep(get_flush_interval())
+        try:
+            flush_hits()
+        except Exception:
+            logger.exception('Could not record search hits')
+        finally:
+            # This thread's connection, don't keep it open between flushes
+            connection.close()
+
+
+@atexit.register
+def flush_on_exit():
+    try:
+        flush_hits()
+    except Exception:
+        logger.exception('Could not record search hits')
@@ -0,0 +1,185 @@
+# -*- coding: UTF-8 -*-
+"""
+Full-text index of the live pages, in an SQLite FTS5 table.
+
+FTS5 only splits words on spaces and punctuation, which leaves a run of
+Chinese characters as a single token. Runs of CJK characters are therefore
+indexed as overlapping bigrams (plus their last character, for one character
+queries) before they reach SQLite, and queries are split the same way, so
+that "大门" matches "打开大门" and results are ranked with BM25.
+
+Pages are indexed when they are published and removed when they are
+unpublished or deleted, see search.signal_handlers. ``rebuild_search_index``
+indexes every live page from scratch.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import re
+import sqlite3
+import threading
+
+from django.conf import settings
+from django.utils.html import strip_tags
+from django.utils.six import string_types
+
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailsearch import index
+
+logger = logging.getLogger(__name__)
+
+# Han, kana and hangul
+CJK_CHARS = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af\uf900-\ufaff'
+TOKEN_RE = re.compile(r'([%s]+)|([^\W%s]+)' % (CJK_CHARS, CJK_CHARS), re.UNICODE)
+
+# BM25 weights of the title and body columns
+TITLE_WEIGHT = 10.0
+BODY_WEIGHT = 1.0
+
+_local = threading.local()
+
+
+class IndexUnavailable(Exception):
+    pass
+
+
+def get_index_path():
+    return getattr(settings, 'SEARCH_INDEX_PATH', os.path.join(settings.BASE_DIR, 'search_index.sqlite3'))
+
+
+def get_connection():
+    """
+    Return this thread's connection to the index, creating the index if needed.
+    Raise ``IndexUnavailable`` when SQLite was built without FTS5.
+    """
+    path = get_index_path()
+    connection = getattr(_local, 'connection', None)
+    if connection is None or _local.path != path:
+        connection = sqlite3.connect(path, timeout=10)
+        try:
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute(
+                'CREATE VIRTUAL TABLE IF NOT EXISTS pages USING fts5(title, body)')
+        except sqlite3.OperationalError as e:
+            connection.close()
+            raise IndexUnavailable(e)
+        _local.connection, _local.path = connection, path
+    return connection
+
+
+def tokenize(text, for_query=False):
+    """
+    Return the tokens of ``text``: its words, and the bigrams of its runs of
+    CJK characters. Indexed runs also yield their last character, so that a
+    single character query matches wherever the character is.
+    """
+    tokens = []
+    for cjk, word in TOKEN_RE.findall(text):
+        if word:
+            tokens.append(word.lower())
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+            if not for_query:
+                tokens.append(cjk[-1])
+    return tokens
+
+
+def build_match_query(query_string):
+    """
+    Return the FTS5 query matching the pages that contain every word and
+    every run of CJK characters of ``query_string``, or None if it has none.
+    """
+    terms = []
+    for cjk, word in TOKEN_RE.findall(query_string):
+        if word:
+            terms.append('"%s"' % word.lower())
+        elif len(cjk) == 1:
+            # Matches the character alone and every bigram it starts
+            terms.append('"%s"*' % cjk)
+        else:
+            terms.append('"%s"' % ' '.join(tokenize(cjk, for_query=True)))
+    if terms:
+        return ' AND '.join(terms)
+
+
+def get_searchable_text(page, field):
+    value = field.get_value(page)
+    if value is None:
+        return ''
+    if not isinstance(value, string_types):
+        # StreamField content is a list of strings
+        value = ' '.join(value)
+    return strip_tags(value)
+
+
+def get_index_document(page):
+    """
+    Return the tokenized ``(title, body)`` of ``page``, a specific page.
+    """
+    body = [
+        get_searchable_text(page, field)
+        for field in page.get_search_fields()
+        if isinstance(field, index.SearchField) and field.field_name != 'title'
+    ]
+    return ' '.join(tokenize(page.title)), ' '.join(tokenize(' '.join(body)))
+
+
+def index_pages(pages):
+    connection = get_connection()
+    with connection:
+        for page in pages:
+            title, body = get_index_document(page)
+            connection.execute('DELETE FROM pages WHERE rowid = ?', (page.id,))
+            connection.execute(
+                'INSERT INTO pages (rowid, title, body) VALUES (?, ?, ?)', (page.id, title, body))
+
+
+def remove_pages(page_ids):
+    connection = get_connection()
+    with connection:
+        connection.executemany('DELETE FROM pages WHERE rowid = ?', [(page_id,) for page_id in page_ids])
+
+
+def rebuild_index(batch_size=500):
+    """
+    Index every live page from scratch, return how many were indexed.
+    """
+    connection = get_connection()
+    with connection:
+        connection.execute('DELETE FROM pages')
+    page_ids = list(Page.objects.live().filter(depth__gt=1).values_list('id', flat=True))
+    for start in range(0, len(page_ids), batch_size):
+        index_pages(Page.objects.filter(id__in=page_ids[start:start + batch_size]).specific())
+    with connection:
+        connection.execute("INSERT INTO pages (pages) VALUES ('optimize')")
+    return len(page_ids)
+
+
+def search(query_string, limit=-1, offset=0):
+    """
+    Return the ids of the indexed pages matching ``query_string``, best match
+    first, ``limit`` of them at most starting at ``offset``.
+    """
+    match_query = build_match_query(query_string)
+    if match_query is None:
+        return []
+    rows = get_connection().execute(
+        'SELECT rowid FROM pages WHERE pages MATCH ? ORDER BY bm25(pages, ?, ?) LIMIT ? OFFSET ?',
+        (match_query, TITLE_WEIGHT, BODY_WEIGHT, limit, offset))
+    return [row[0] for row in rows]
+
+
+def count(query_string, limit=-1):
+    """
+    Return how many indexed pages match ``query_string``, counting up to ``limit``.
+    """
+    match_query = build_match_query(query_string)
+    if match_query is None:
+        return 0
+    row = get_connection().execute(
+        'SELECT count(*) FROM (SELECT rowid FROM pages WHERE pages MATCH ? LIMIT ?)',
+        (match_query, limit)).fetchone()
+    return row[0]
@@ -0,0 +1,18 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.core.management.base import BaseCommand
+
+from search.index import get_index_path, rebuild_index
+from search.results import invalidate_results
+
+
+class Command(BaseCommand):
+    help = 'Index every live page in the full-text search index from scratch.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        indexed = rebuild_index(batch_size=options['batch_size'])
+        invalidate_results()
+        self.stdout.write('%d pages indexed in %s' % (indexed, get_index_path()))
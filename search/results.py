@@ -0,0 +1,141 @@
+"""
+Search result cache.
+
+Each page of results is fetched on its own, one result more than it shows to
+tell whether there is a next one, so that neither counting the matches nor
+showing a deep page goes through the whole match set. The ids are cached
+under the normalised query and page number, for ``SEARCH_CACHE_TIMEOUT``
+seconds or until a page is published, unpublished or deleted, see
+search.signal_handlers.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import hashlib
+import logging
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+from wagtail.wagtailcore.models import Page
+
+from search import index
+
+logger = logging.getLogger(__name__)
+
+RESULTS_KEY = 'search:results:%s:%s:%d:%d'
+COUNT_KEY = 'search:count:%s:%s:%d'
+VERSION_KEY = 'search:results-version'
+# Deeper pages are empty, their offsets would overflow the index queries
+MAX_PAGE = 1000
+
+
+def normalise_query(query_string):
+    return ' '.join(query_string.lower().split())
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+def invalidate_results():
+    cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+
+def get_timeout():
+    return getattr(settings, 'SEARCH_CACHE_TIMEOUT', 60 * 5)
+
+
+def get_query_hash(query_string):
+    return hashlib.md5(normalise_query(query_string).encode('utf-8')).hexdigest()
+
+
+def get_result_ids(query_string, limit, offset=0):
+    """
+    Return the ids of the live pages matching ``query_string``, best match
+    first, ``limit`` of them at most starting at ``offset``.
+    """
+    key = RESULTS_KEY % (get_version(), get_query_hash(query_string), limit, offset)
+    result_ids = cache.get(key)
+    if result_ids is None:
+        try:
+            result_ids = index.search(query_string, limit=limit, offset=offset)
+        except index.IndexUnavailable:
+            logger.warning('The search index is unavailable, using the database search backend')
+            results = Page.objects.live().search(query_string)[offset:offset + limit]
+            result_ids = [page.id for page in results]
+        cache.set(key, result_ids, get_timeout())
+    return result_ids
+
+
+def get_result_count(query_string, limit):
+    """
+    Return how many live pages match ``query_string``, counting up to ``limit``.
+    """
+    key = COUNT_KEY % (get_version(), get_query_hash(query_string), limit)
+    result_count = cache.get(key)
+    if result_count is None:
+        try:
+            result_count = index.count(query_string, limit=limit)
+        except index.IndexUnavailable:
+            result_count = len(Page.objects.live().search(query_string)[:limit])
+        cache.set(key, result_count, get_timeout())
+    return result_count
+
+
+def get_pages(page_ids):
+    """
+    Return the pages with ``page_ids``, in the same order, skipping the ones
+    that no longer exist.
+    """
+    pages = Page.objects.live().in_bulk(page_ids)
+    return [pages[page_id] for page_id in page_ids if page_id in pages]
+
+
+class ResultsPage(object):
+    """
+    A page of search results, with the interface of the paginator pages the
+    template uses but without a count of the pages. ``total`` is the number of
+    matches up to ``count_limit``, ``total_is_capped`` tells if there are more.
+    Pages past ``MAX_PAGE`` have no results.
+    """
+
+    def __init__(self, query_string, number, per_page, count_limit=None):
+        self.number = number
+        if number <= MAX_PAGE:
+            result_ids = get_result_ids(query_string, per_page + 1, (number - 1) * per_page)
+        else:
+            result_ids = []
+        self._has_next = len(result_ids) > per_page
+        self.object_list = get_pages(result_ids[:per_page])
+
+        self.total = self.total_is_capped = None
+        if count_limit:
+            self.total = get_result_count(query_string, count_limit + 1)
+            self.total_is_capped = self.total > count_limit
+            self.total = min(self.total, count_limit)
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_previous(self):
+        return self.number > 1
+
+    def has_next(self):
+        return self._has_next
+
+    def has_other_pages(self):
+        return self.has_previous() or self.has_next()
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    def next_page_number(self):
+        return self.number + 1
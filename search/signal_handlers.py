@@ -0,0 +1,54 @@
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+from django.db.models.signals import post_delete, post_save, pre_save
+
+from wagtail.wagtailcore.models import Page
+from wagtail.wagtailcore.signals import page_published, page_unpublished
+
+from search import index
+from search.results import invalidate_results
+from search.suggestions import suggestion_index
+
+logger = logging.getLogger(__name__)
+
+
+def page_published_handler(sender, instance, **kwargs):
+    try:
+        index.index_pages([instance])
+    except index.IndexUnavailable:
+        logger.warning('The search index is unavailable, %r was not indexed', instance)
+    invalidate_results()
+    suggestion_index.update_page(instance)
+
+
+def page_removed_handler(sender, instance, **kwargs):
+    try:
+        index.remove_pages([instance.id])
+    except index.IndexUnavailable:
+        pass
+    invalidate_results()
+    suggestion_index.update_page(instance, remove=True)
+
+
+def page_pre_save_handler(sender, instance, **kwargs):
+    # Page.move saves the moved page as a plain Page, with its new url_path
+    if instance.id:
+        instance._search_old_url_path = Page.objects.filter(
+            id=instance.id).values_list('url_path', flat=True).first()
+
+
+def page_saved_handler(sender, instance, **kwargs):
+    # The urls of the suggested pages change when a page is moved
+    old_url_path = getattr(instance, '_search_old_url_path', None)
+    if old_url_path is not None and old_url_path != instance.url_path:
+        suggestion_index.invalidate()
+
+
+def register_signal_handlers():
+    page_published.connect(page_published_handler)
+    page_unpublished.connect(page_removed_handler)
+    post_delete.connect(page_removed_handler, sender=Page)
+    pre_save.connect(page_pre_save_handler, sender=Page)
+    post_save.connect(page_saved_handler, sender=Page)
@@ -0,0 +1,124 @@
+# -*- coding: UTF-8 -*-
+"""
+Title suggestions for the search box.
+
+Every process keeps the titles of the live pages in a sorted array in memory
+and answers prefix lookups with a binary search, without any query. The
+array is updated when a page is published, unpublished or deleted,
+and the other processes rebuild theirs on their next lookup: the change
+bumps a version shared through the cache, see ``SuggestionIndex.get``.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import threading
+import uuid
+from bisect import bisect_left, insort
+
+from django.core.cache import cache
+from django.contrib.contenttypes.models import ContentType
+
+from wagtail.wagtailcore.models import Page
+
+from home.models import CategoryPage, GalleryPage, SimplePage
+
+VERSION_KEY = 'search:suggestions-version'
+MAX_SUGGESTIONS = 10
+
+
+def normalise_title(title):
+    return ' '.join(title.lower().split())
+
+
+def get_keys(title):
+    """
+    Return the strings a prefix of which suggests ``title``: the whole title
+    and what follows each space in it, so that "world" suggests "Hello World".
+    """
+    title = normalise_title(title)
+    return [title] + [title[i + 1:] for i, char in enumerate(title) if char == ' ']
+
+
+def get_suggested_pages():
+    content_types = ContentType.objects.get_for_models(CategoryPage, GalleryPage, SimplePage).values()
+    return Page.objects.live().filter(content_type__in=content_types)
+
+
+def get_version():
+    version = cache.get(VERSION_KEY)
+    if version is None:
+        cache.add(VERSION_KEY, uuid.uuid4().hex, None)
+        version = cache.get(VERSION_KEY)
+    return version
+
+
+class SuggestionIndex(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.version = None
+        self.keys = []  # sorted (key, page id) pairs
+        self.pages = {}  # page id: {'title', 'url'}
+
+    def rebuild(self, version):
+        keys = []
+        pages = {}
+        for page in get_suggested_pages().only('id', 'title', 'url_path'):
+            pages[page.id] = {'title': page.title, 'url': page.url}
+            keys.extend((key, page.id) for key in get_keys(page.title))
+        keys.sort()
+        with self.lock:
+            self.keys, self.pages, self.version = keys, pages, version
+
+    def get(self, prefix, limit=MAX_SUGGESTIONS):
+        """
+        Return the titles and urls of the pages with a title starting with
+        ``prefix``, or a word in it, in alphabetical order.
+        """
+        version = get_version()
+        if version != self.version:
+            self.rebuild(version)
+
+        prefix = normalise_title(prefix)
+        if not prefix:
+            return []
+        with self.lock:
+            keys, pages = self.keys, self.pages
+        page_ids = []
+        position = bisect_left(keys, (prefix,))
+        while position < len(keys) and keys[position][0].startswith(prefix):
+            page_id = keys[position][1]
+            if page_id not in page_ids:
+                page_ids.append(page_id)
+                if len(page_ids) == limit:
+                    break
+            position += 1
+        return [pages[page_id] for page_id in page_ids if page_id in pages]
+
+    def invalidate(self):
+        cache.set(VERSION_KEY, uuid.uuid4().hex, None)
+
+    def update_page(self, page, remove=False):
+        """
+        Add or refresh ``page``, or take it out when ``remove`` is True, and
+        make the other processes rebuild their index.
+        """
+        with self.lock:
+            up_to_date = self.version is not None and self.version == get_version()
+            version = uuid.uuid4().hex
+            cache.set(VERSION_KEY, version, None)
+            if not up_to_date:
+                # Rebuilt on the next lookup anyway
+                return
+
+            # Lookups read the arrays without the lock, change copies of them
+            keys = [item for item in self.keys if item[1] != page.id]
+            pages = dict(self.pages)
+            pages.pop(page.id, None)
+            if not remove and get_suggested_pages().filter(id=page.id).exists():
+                pages[page.id] = {'title': page.title, 'url': page.url}
+                for key in get_keys(page.title):
+                    insort(keys, (key, page.id))
+            self.keys, self.pages, self.version = keys, pages, version
+
+
+suggestion_index = SuggestionIndex()
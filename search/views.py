@@ -1,36 +1,39 @@
 from __future__ import absolute_import, unicode_literals
 
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.conf import settings
+from django.http import JsonResponse
 from django.shortcuts import render
 
-from wagtail.wagtailcore.models import Page
-from wagtail.wagtailsearch.models import Query
+from search.hits import record_hit
+from search.results import ResultsPage
+from search.suggestions import suggestion_index
 
 
 def search(request):
     search_query = request.GET.get('query', None)
-    page = request.GET.get('page', 1)
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
 
     # Search
     if search_query:
-        search_results = Page.objects.live().search(search_query)
-        query = Query.get(search_query)
+        search_results = ResultsPage(
+            search_query, page, per_page=10,
+            count_limit=getattr(settings, 'SEARCH_COUNT_LIMIT', 1000))
 
         # Record hit
-        query.add_hit()
+        record_hit(search_query)
     else:
-        search_results = Page.objects.none()
-
-    # Pagination
-    paginator = Paginator(search_results, 10)
-    try:
-        search_results = paginator.page(page)
-    except PageNotAnInteger:
-        search_results = paginator.page(1)
-    except EmptyPage:
-        search_results = paginator.page(paginator.num_pages)
+        search_results = []
 
     return render(request, 'search/search.html', {
         'search_query': search_query,
         'search_results': search_results,
     })
+
+
+def suggest(request):
+    return JsonResponse({
+        'suggestions': suggestion_index.get(request.GET.get('query', '')),
+    })